@@ -0,0 +1,407 @@
+"""Benchmarks: scripted game scenarios and micro-benchmarks of hot paths.
+
+    python bench.py                              # every scenario, JSON out
+    python bench.py --scenario title_idle        # just one
+    python bench.py --output baseline.json       # store a baseline
+    python bench.py --compare baseline.json      # flag regressions
+    python bench.py --micro                      # the hot-path timings
+    python bench.py --startup                    # time to first frame
+
+Each scenario drives the real front end with a scripted player and a
+fixed seed, one simulation tick per frame and with no frame cap. It is
+run twice, once timed and once under tracemalloc, and reports frame-time
+percentiles, updates per second, peak traced memory and allocations per
+frame.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame  # noqa: E402
+from pygame import font, transform  # noqa: E402
+
+from headless import autopilot  # noqa: E402
+from spaceinvaders import (BASE_PATH, FONT, GREEN, IMAGES,  # noqa: E402
+                           INPUT_FIRE, INPUT_LEFT, INPUT_RIGHT,
+                           AllocationCounter, AssetBundle, Debris,
+                           SpaceInvaders, Viewport)
+
+SEED = 1
+# keyword arguments for every SpaceInvaders the scenarios build
+FRONT_END = {}
+# ship x positions under the middle of each bunker
+BUNKER_CENTRES = [50 + 200 * number + 45 - 25 for number in range(4)]
+# metrics where a larger value is worse; updates_per_sec is the reverse
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_kib',
+                   'kib_per_frame', 'blocks_per_frame')
+
+
+def legacy_scaling():
+    """The transform.scale calls a round reset and a title-screen frame
+    made before scaled images were shared through ATLAS."""
+    for row in ['1_2', '1_1'] * 5 + ['2_2', '2_1'] * 10 + ['3_1', '3_2'] * 10:
+        transform.scale(IMAGES['alien' + row], (40, 35))
+    transform.scale(IMAGES['mystery'], (75, 35))
+    for _ in range(3):
+        transform.scale(IMAGES['ship'], (23, 23))
+    for name in ('alien3_1', 'alien2_2', 'alien1_2'):
+        transform.scale(IMAGES[name], (40, 40))
+    transform.scale(IMAGES['mystery'], (80, 40))
+
+
+def legacy_score_text(surface, score):
+    """Per-frame score HUD as drawn before fonts and glyphs were cached."""
+    text = font.Font(FONT, 20).render(str(score), True, GREEN)
+    surface.blit(text, (85, 5))
+
+
+def measure(func, number):
+    """Best-of-five mean time per call, in milliseconds."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def score_text(game):
+    game.scoreText2.set_value(game.sim.score)
+    game.scoreText2.draw(game.screen)
+
+
+def draw_debris(debris, surface):
+    for _, image, pos in debris.draw_items():
+        surface.blit(image, pos)
+
+
+def micro():
+    game = SpaceInvaders()
+    game.reset(0, 3, True)
+    game.sim.score = 12340
+    game.change_scene('title')
+    title = game.scene
+    results = [
+        ('simulation reset', measure(lambda: game.sim.reset(0, 3), 200)),
+        ('title screen frame', measure(title.update, 2000)),
+        ('scaling removed per reset', measure(legacy_scaling, 200)),
+        ('score text', measure(lambda: score_text(game), 2000)),
+        ('score text, uncached', measure(
+            lambda: legacy_score_text(game.screen, game.sim.score), 2000)),
+    ]
+    debris = Debris(seed=SEED)
+    for burst in range(100):
+        debris.spawn(100 + 6 * burst, 300, burst % 7, 40, 250, 1.0)
+    results += [
+        ('debris update, 4000 sparks',
+         measure(lambda: debris.update(0), 2000)),
+        ('debris draw, 4000 sparks', measure(
+            lambda: draw_debris(debris, game.screen), 2000)),
+    ]
+    for name, size, smooth in (('scale pass, 1080p smooth', (1920, 1080),
+                                 True),
+                                ('scale pass, 4K integer', (3840, 2160),
+                                 False)):
+        viewport = Viewport(pygame.Surface(size), smooth)
+        results.append((name, measure(partial(viewport.scale, True), 50)))
+    loads = game.sounds.loads
+    results.append(('round reset', measure(lambda: game.reset(0, 3), 200)))
+    for name, ms in results:
+        print('{:<28}{:8.3f} ms'.format(name, ms))
+    print('{:<28}{:8d}'.format('sound loads in 1000 resets',
+                               game.sounds.loads - loads))
+
+
+# run in a fresh interpreter; prints seconds taken by the import, then from
+# the end of the import to the first frame and to the title screen
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import spaceinvaders
+imported = time.perf_counter()
+spaceinvaders.BUNDLE_PATH = {bundle!r}
+game = spaceinvaders.SpaceInvaders(load_in_background={background})
+if game.ready:
+    game.start()
+else:
+    game.change_scene('loading')
+game.frame()
+first = time.perf_counter()
+title = game.scenes['title']
+while game.scene is not title or title.redraw:
+    game.clock.tick(spaceinvaders.TICK_RATE)
+    game.frame()
+print(imported - start, first - imported, time.perf_counter() - imported)
+"""
+
+
+def startup(runs=5):
+    """Median time to import, then to the first frame and to the title
+    screen, with and without the asset bundle and background loading."""
+    env = dict(os.environ, PYTHONPATH=BASE_PATH,
+               PYGAME_HIDE_SUPPORT_PROMPT='1')
+    with tempfile.TemporaryDirectory() as directory:
+        bundle = os.path.join(directory, 'assets.bin')
+        AssetBundle.bake(bundle)
+        print('{:<34}{:>10}{:>14}{:>10}'.format('', 'import', 'first frame',
+                                                'title'))
+        for use_bundle in (False, True):
+            for background in (False, True):
+                script = STARTUP_SCRIPT.format(
+                    bundle=bundle if use_bundle else '',
+                    background=background)
+                times = [[float(t) for t in subprocess.check_output(
+                    [sys.executable, '-c', script], env=env,
+                    stderr=subprocess.DEVNULL).split()] for _ in range(runs)]
+                name = '{}, {}'.format(
+                    'bundle' if use_bundle else 'PNG/WAV',
+                    'background load' if background else 'load up front')
+                print('{:<34}{:>8.1f}ms{:>12.1f}ms{:>8.1f}ms'.format(
+                    name, *(statistics.median(column) * 1000
+                            for column in zip(*times))))
+
+
+def start_game(rules=None, player=autopilot, invincible=False,
+               debris=False):
+    """A front end in the playing scene with a seeded new game."""
+    game = SpaceInvaders(rules=rules, player=player, debris=debris,
+                         **FRONT_END)
+    game.sim.reset(0, 3, True, SEED)
+    if invincible:
+        # keep a fixed workload running instead of ending in game over
+        game.sim.lives = sys.maxsize
+    game.reset_lives(game.sim.lives)
+    game.change_scene('playing')
+    return game
+
+
+def bunker_sweeper(sim):
+    """Walk from bunker to bunker, firing into each from underneath."""
+    target = BUNKER_CENTRES[sim.tick // 150 % len(BUNKER_CENTRES)]
+    ship = sim.player.rect.x
+    if target < ship - 5:
+        return INPUT_FIRE | INPUT_LEFT
+    if target > ship + 5:
+        return INPUT_FIRE | INPUT_RIGHT
+    return INPUT_FIRE
+
+
+def wave_clear():
+    """The stock 10x5 wave, cleared by the autopilot."""
+    game = start_game(invincible=True)
+    return partial(game.frame, 1), lambda: game.sim.round_over
+
+
+def max_bullets():
+    """Both sides firing every tick with no cap that is ever reached."""
+    game = start_game(rules={'bullet_limit': 64, 'alien_bullet_limit': 256,
+                             'alien_fire_interval': 0}, invincible=True)
+    return partial(game.frame, 1), None
+
+
+def bunker_erosion():
+    """Every bunker shot away from below while the aliens fire down."""
+    game = start_game(player=bunker_sweeper,
+                      rules={'alien_fire_interval': 50}, invincible=True)
+    return partial(game.frame, 1), None
+
+
+def title_idle():
+    """The title screen waiting for a key."""
+    game = SpaceInvaders(**FRONT_END)
+    game.change_scene('title')
+    return partial(game.frame, 1), None
+
+
+def round_transitions():
+    """A round reset through SpaceInvaders.reset() before every frame."""
+    game = start_game()
+
+    def frame():
+        game.reset(game.sim.score, game.sim.lives)
+        game.frame(1)
+    return frame, None
+
+
+def stress_formation():
+    """A 24x16 formation, nearly eight times the stock wave. Its aliens
+    are scaled to 0.4 so it is no wider than the stock formation and
+    every alien can be drawn and shot."""
+    game = start_game(rules={'alien_columns': 24, 'alien_rows': 16,
+                             'alien_scale': 0.4},
+                      invincible=True)
+    return partial(game.frame, 1), None
+
+
+def debris_storm():
+    """A wave cleared while bursts keep about 4000 sparks in the air."""
+    game = start_game(invincible=True, debris=True)
+    debris = game.debris
+    debris.rng = np.random.default_rng(SEED)
+    frames = [0]
+
+    def frame():
+        frames[0] += 1
+        debris.spawn(100 + frames[0] * 37 % 600, 300, frames[0] % 7, 48,
+                     200, 1.2)
+        game.frame(1)
+    return frame, None
+
+
+# name, setup, frames to run (or the most to run before done() is true)
+SCENARIOS = [
+    ('wave_clear', wave_clear, 20000),
+    ('max_bullets', max_bullets, 1200),
+    ('bunker_erosion', bunker_erosion, 1200),
+    ('title_idle', title_idle, 1200),
+    ('round_transitions', round_transitions, 300),
+    ('stress_formation', stress_formation, 1200),
+    ('debris_storm', debris_storm, 1200),
+]
+
+
+def run_frames(setup, frames, hook=None):
+    """Run a scenario; returns each frame's duration in seconds."""
+    frame, done = setup()
+    # start each pass from the same collector state, so net block counts
+    # don't depend on what ran before
+    gc.collect()
+    times = []
+    clock = time.perf_counter
+    for _ in range(frames):
+        if hook:
+            hook.start_frame()
+        start = clock()
+        frame()
+        times.append(clock() - start)
+        if hook:
+            hook.end_frame('frame')
+        if done and done():
+            break
+    return times
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(setup, frames):
+    times = run_frames(setup, frames)
+    ordered = sorted(times)
+
+    counter = AllocationCounter()
+    peak = [0]
+    end_frame = counter.end_frame
+
+    def track_peak(scene):
+        peak[0] = max(peak[0], tracemalloc.get_traced_memory()[1])
+        end_frame(scene)
+    counter.end_frame = track_peak
+    try:
+        run_frames(setup, len(times), counter)
+    finally:
+        tracemalloc.stop()
+
+    counted = counter.frames['frame']
+    return {
+        'frames': len(times),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'updates_per_sec': len(times) / sum(times),
+        'peak_kib': peak[0] / 1024.0,
+        'kib_per_frame': counter.allocated['frame'] / 1024.0 / counted,
+        'blocks_per_frame': counter.blocks['frame'] / float(counted),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Print each metric against the baseline; returns the regressions."""
+    regressions = []
+    for name, metrics in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            print('{:<20}not in baseline'.format(name))
+            continue
+        for metric, value in metrics.items():
+            if metric == 'frames' or metric not in base:
+                continue
+            old = base[metric]
+            if metric in LOWER_IS_BETTER:
+                worse = value > old * (1 + threshold)
+            else:
+                worse = value < old / (1 + threshold)
+            change = (value - old) / old * 100 if old else 0.0
+            flag = 'REGRESSION' if worse else ''
+            print('{:<20}{:<18}{:12.3f}{:12.3f}{:+9.1f}%  {}'.format(
+                name, metric, old, value, change, flag))
+            if worse:
+                regressions.append((name, metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    names = [name for name, _, _ in SCENARIOS]
+    parser.add_argument('--scenario', action='append', choices=names,
+                        help='run only this scenario (may be repeated)')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write the JSON results to PATH')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare against a stored JSON baseline and '
+                             'exit non-zero on any regression')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative change counted as a regression '
+                             '(default 0.25)')
+    parser.add_argument('--threaded', action='store_true',
+                        help='run the scenarios with the render thread')
+    parser.add_argument('--micro', action='store_true',
+                        help='run the hot-path micro-benchmarks instead')
+    parser.add_argument('--startup', action='store_true',
+                        help='time startup to the first frame instead')
+    args = parser.parse_args()
+
+    if args.micro:
+        micro()
+        return
+    if args.startup:
+        startup()
+        return
+
+    FRONT_END['threaded'] = args.threaded
+    results = {'python': platform.python_version(),
+               'pygame': pygame.version.ver,
+               'threaded': args.threaded,
+               'cpus': os.cpu_count(),
+               'scenarios': {}}
+    for name, setup, frames in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        results['scenarios'][name] = run_scenario(setup, frames)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        print('{} regression(s)'.format(len(regressions)))
+        raise SystemExit(1 if regressions else 0)
+    if not args.output:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
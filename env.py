@@ -0,0 +1,322 @@
+"""Gym-style environments for training and evaluating automated players.
+
+    env = SpaceInvadersEnv(seed=1)
+    observation, info = env.reset()
+    observation, reward, terminated, truncated, info = env.step(INPUT_FIRE)
+
+An action is a combination of the INPUT_* bits (0 to 7) and the reward is
+the score gained during the step. Observations are either a compact
+feature vector or a 100x75 occupancy grid, one cell per 8x8 pixels.
+snapshot() and restore() save and return to any point of an episode, so a
+search can branch from one state as often as it likes.
+
+VectorEnv runs many environments in worker processes that write their
+observations straight into shared memory, so nothing but a short command
+crosses the pipes each step:
+
+    python env.py --envs 64 --workers 8 --steps 2000
+"""
+import argparse
+import multiprocessing
+import os
+import timeit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from pygame import surfarray  # noqa: E402
+
+from spaceinvaders import Simulation  # noqa: E402
+
+NUM_ACTIONS = 8
+# alien shots in the feature vector, nearest the bottom first
+TRACKED_SHOTS = 8
+CELL = 8
+GRID_SHAPE = (600 // CELL, 800 // CELL)
+# occupancy grid values; later entries are drawn over earlier ones
+BUNKER, ALIEN, MYSTERY, SHOT, ALIEN_SHOT, SHIP = 64, 128, 160, 192, 224, 255
+
+
+def fill_cells(grid, rect, value):
+    """Mark every grid cell rect touches, clipped to the screen."""
+    left = max(rect.left, 0) // CELL
+    right = (min(rect.right, 800) + CELL - 1) // CELL
+    top = max(rect.top, 0) // CELL
+    bottom = (min(rect.bottom, 600) + CELL - 1) // CELL
+    if left < right and top < bottom:
+        grid[top:bottom, left:right] = value
+
+
+class SpaceInvadersEnv(object):
+    """One game, stepped frame_skip ticks per action.
+
+    reset() and step() follow the Gymnasium API. An episode ends
+    (terminated) at game over, or is truncated after max_ticks.
+    """
+
+    def __init__(self, observation='features', frame_skip=1, max_ticks=None,
+                 rules=None, seed=None):
+        if observation not in ('features', 'grid'):
+            raise ValueError('observation must be "features" or "grid"')
+        self.observation = observation
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.sim = Simulation(seed=seed, **(rules or {}))
+        if observation == 'features':
+            aliens = self.sim.alien_columns * self.sim.alien_rows
+            self.observation_shape = (aliens + 2 * TRACKED_SHOTS + 8,)
+            self.observation_dtype = np.float32
+        else:
+            self.observation_shape = GRID_SHAPE
+            self.observation_dtype = np.uint8
+
+    def reset(self, seed=None, out=None):
+        """Start a new game; returns (observation, info)."""
+        sim = self.sim
+        if seed is None:
+            # derive it, so a seeded environment stays reproducible
+            seed = sim.random.getrandbits(63)
+        sim.reset(0, 3, True, seed)
+        return self.observe(out), {'seed': sim.seed}
+
+    def step(self, action, out=None):
+        """Apply the INPUT_* bits in action for frame_skip ticks; returns
+        (observation, reward, terminated, truncated, info)."""
+        sim = self.sim
+        score = sim.score
+        for _ in range(self.frame_skip):
+            sim.step(action)
+            if sim.game_over:
+                break
+        truncated = (self.max_ticks is not None and
+                     sim.tick >= self.max_ticks and not sim.game_over)
+        info = {'score': sim.score, 'lives': sim.lives, 'tick': sim.tick}
+        return (self.observe(out), sim.score - score, sim.game_over,
+                truncated, info)
+
+    def snapshot(self):
+        """The game's state as bytes, for restore()."""
+        return self.sim.snapshot()
+
+    def restore(self, state, out=None):
+        """Go back to a snapshot(), e.g. to try another branch of a search;
+        returns the observation there."""
+        self.sim.restore(state)
+        return self.observe(out)
+
+    def observe(self, out=None):
+        """The current observation, written into out if given."""
+        if out is None:
+            out = np.empty(self.observation_shape, self.observation_dtype)
+        if self.observation == 'features':
+            self.features(out)
+        else:
+            self.grid(out)
+        return out
+
+    def features(self, out):
+        """Positions scaled to 0..1: the ship, the formation, every alien's
+        alive flag, the mystery ship and the lowest alien shots."""
+        sim = self.sim
+        aliens = sim.aliens
+        count = aliens.alive.size
+        out[:count] = aliens.alive
+        out[count:count + 8] = (
+            sim.player.rect.x / 800.0, sim.ship_alive,
+            aliens.x[0] / 800.0, aliens.y[0] / 600.0,
+            sim.mystery_ship.rect.x / 800.0,
+            len(sim.bullets) / float(sim.bullet_limit),
+            sim.lives / 3.0, len(aliens) / float(count))
+        shots = out[count + 8:].reshape(TRACKED_SHOTS, 2)
+        shots.fill(-1)
+        lowest = sorted((bullet.rect.y, bullet.rect.x)
+                        for bullet in sim.alien_bullets)[-TRACKED_SHOTS:]
+        for slot, (y, x) in enumerate(reversed(lowest)):
+            shots[slot] = x / 800.0, y / 600.0
+
+    def grid(self, out):
+        """Occupancy of each 8x8 pixel cell, coded by what fills it."""
+        sim = self.sim
+        out.fill(0)
+        for blocker in sim.allBlockers:
+            rect = blocker.rect
+            # align the bunker's pixels to the cell grid, then reduce blocks
+            top, left = rect.y % CELL, rect.x % CELL
+            rows = -(-(top + rect.height) // CELL)
+            cols = -(-(left + rect.width) // CELL)
+            solid = np.zeros((rows * CELL, cols * CELL), np.bool_)
+            solid[top:top + rect.height, left:left + rect.width] = \
+                surfarray.pixels_alpha(blocker.image).T > 0
+            cells = solid.reshape(rows, CELL, cols, CELL).any(axis=(1, 3))
+            out[rect.y // CELL:rect.y // CELL + rows,
+                rect.x // CELL:rect.x // CELL + cols][cells] = BUNKER
+        aliens = sim.aliens
+        for index in np.flatnonzero(aliens.alive):
+            fill_cells(out, aliens.rect(index), ALIEN)
+        fill_cells(out, sim.mystery_ship.rect, MYSTERY)
+        for bullet in sim.bullets:
+            fill_cells(out, bullet.rect, SHOT)
+        for bullet in sim.alien_bullets:
+            fill_cells(out, bullet.rect, ALIEN_SHOT)
+        if sim.ship_alive:
+            fill_cells(out, sim.player.rect, SHIP)
+
+
+def worker(connection, memory_name, start, stop, num_envs, env_kwargs,
+           seed):
+    """Own environments start..stop of a VectorEnv, stepping them on
+    command and writing results into its shared buffers."""
+    envs = [SpaceInvadersEnv(**env_kwargs) for _ in range(start, stop)]
+    memory = shared_memory.SharedMemory(name=memory_name)
+    buffers = VectorEnv.buffers(memory, num_envs, envs[0])
+    observations, actions, rewards, terminated, truncated = (
+        array[start:stop] for array in buffers)
+    try:
+        while True:
+            command = connection.recv()
+            if command == 'step':
+                for index, env in enumerate(envs):
+                    _, reward, done, cut, _ = env.step(
+                        int(actions[index]), observations[index])
+                    rewards[index] = reward
+                    terminated[index] = done
+                    truncated[index] = cut
+                    if done or cut:
+                        env.reset(out=observations[index])
+            elif command == 'reset':
+                for index, env in enumerate(envs):
+                    env.reset(None if seed is None else seed + start + index,
+                              observations[index])
+            elif command == 'close':
+                break
+            connection.send(None)
+    finally:
+        del observations, actions, rewards, terminated, truncated, buffers
+        memory.close()
+        connection.close()
+
+
+class VectorEnv(object):
+    """num_envs SpaceInvadersEnv spread over worker processes.
+
+    step() takes one action per environment and returns (observations,
+    rewards, terminated, truncated) as arrays with one row per
+    environment. They are views of the shared buffers and are overwritten
+    by the next step, so copy anything that must outlive it. Environments
+    that end are reset straight away; their row then holds the first
+    observation of the next game.
+    """
+
+    def __init__(self, num_envs, workers=None, seed=None, **env_kwargs):
+        self.num_envs = num_envs
+        workers = min(workers or os.cpu_count() or 1, num_envs)
+        probe = SpaceInvadersEnv(**env_kwargs)
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=self.buffer_size(num_envs, probe))
+        (self.observations, self.actions, self.rewards, self.terminated,
+         self.truncated) = self.buffers(self.memory, num_envs, probe)
+        self.connections = []
+        self.processes = []
+        bounds = np.linspace(0, num_envs, workers + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=worker, daemon=True,
+                args=(child, self.memory.name, int(start), int(stop),
+                      num_envs, env_kwargs, seed))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    @staticmethod
+    def layout(num_envs, env):
+        """(shape, dtype) of each shared buffer, in order."""
+        return [((num_envs,) + env.observation_shape, env.observation_dtype),
+                ((num_envs,), np.uint8), ((num_envs,), np.int32),
+                ((num_envs,), np.bool_), ((num_envs,), np.bool_)]
+
+    @classmethod
+    def buffer_size(cls, num_envs, env):
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize
+                   for shape, dtype in cls.layout(num_envs, env))
+
+    @classmethod
+    def buffers(cls, memory, num_envs, env):
+        """Arrays laid out back to back over a shared memory block."""
+        arrays = []
+        offset = 0
+        for shape, dtype in cls.layout(num_envs, env):
+            array = np.ndarray(shape, dtype, memory.buf, offset)
+            offset += array.nbytes
+            arrays.append(array)
+        return arrays
+
+    def command(self, name):
+        for connection in self.connections:
+            connection.send(name)
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self):
+        self.command('reset')
+        return self.observations
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self.command('step')
+        return self.observations, self.rewards, self.terminated, \
+            self.truncated
+
+    def close(self):
+        if self.memory is None:
+            return
+        for connection in self.connections:
+            connection.send('close')
+        for process in self.processes:
+            process.join()
+        del self.observations, self.actions, self.rewards, self.terminated, \
+            self.truncated
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--observation', choices=['features', 'grid'],
+                        default='features')
+    parser.add_argument('--frame-skip', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with VectorEnv(args.envs, args.workers, args.seed,
+                   observation=args.observation,
+                   frame_skip=args.frame_skip) as envs:
+        envs.reset()
+        actions = rng.integers(0, NUM_ACTIONS, (args.steps, args.envs))
+        elapsed = timeit.timeit(
+            lambda: [envs.step(action) for action in actions], number=1)
+    ticks = args.steps * args.envs * args.frame_skip
+    print('{} envs x {} steps in {:.2f}s ({:.0f} env steps/s, '
+          '{:.0f} ticks/s)'.format(args.envs, args.steps, elapsed,
+                                   args.steps * args.envs / elapsed,
+                                   ticks / elapsed))
+
+
+if __name__ == '__main__':
+    main()
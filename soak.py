@@ -0,0 +1,269 @@
+"""Play thousands of rounds headless and check that memory stays flat.
+
+    python soak.py --rounds 2000
+    python soak.py --rounds 200 --frontend     # through the whole front end
+
+At every round boundary it samples the process RSS, the memory traced by
+tracemalloc, the live sprites in each group, the live instances of each
+game and sprite class, how full each gc generation was and how many
+reference cycles a collection then freed. Once the warm-up rounds are
+over, a metric that keeps growing to the end fails the run (exit status
+1), and the lines tracemalloc saw grow the most are printed to show where.
+"""
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+from array import array
+from collections import Counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from headless import autopilot  # noqa: E402
+from spaceinvaders import SpaceInvaders, Simulation  # noqa: E402
+
+# modules whose classes have their live instances counted
+COUNTED_MODULES = ('spaceinvaders', 'pygame.sprite')
+# Simulation groups sampled at each round boundary
+SIM_GROUPS = ('all_sprites', 'player_group', 'mystery_group',
+              'explosions', 'allBlockers', 'bullets', 'alien_bullets')
+
+
+def rss_kib():
+    """Resident set size of this process, or None where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class SimulationRunner(object):
+    """Rounds played by a bare Simulation, as fast as it will go."""
+
+    def __init__(self, seed):
+        self.sim = Simulation(seed=seed)
+        self.game = None
+
+    def play_round(self):
+        """Step until the next round starts, or the game is lost and a new
+        one started in its place."""
+        sim = self.sim
+        while True:
+            if sim.game_over:
+                sim.reset(0, 3, True, sim.random.getrandbits(63))
+                return
+            between_rounds = sim.round_over
+            sim.step(autopilot(sim))
+            if between_rounds and not sim.round_over:
+                return
+
+    def groups(self):
+        return {name: len(getattr(self.sim, name)) for name in SIM_GROUPS}
+
+
+class FrontEndRunner(SimulationRunner):
+    """Rounds played through SpaceInvaders, drawing every frame."""
+
+    def __init__(self, seed, ticks_per_frame):
+        self.game = SpaceInvaders(player=autopilot)
+        self.game.new_game()
+        self.game.sim.reset(0, 3, True, seed)
+        self.sim = self.game.sim
+        self.ticks_per_frame = ticks_per_frame
+
+    def play_round(self):
+        game = self.game
+        start = game.scene.name
+        while True:
+            game.frame(self.ticks_per_frame)
+            scene = game.scene.name
+            if scene == 'game_over':
+                # skip the three second game over screen and the title
+                game.new_game()
+                return
+            if start == 'round' and scene == 'playing':
+                return
+            start = scene
+
+    def groups(self):
+        groups = SimulationRunner.groups(self)
+        groups['lives_group'] = len(self.game.lives_group)
+        return groups
+
+
+def traced_kib():
+    """Memory traced by tracemalloc, leaving out the samples this script
+    keeps."""
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, __file__)])
+    return sum(stat.size for stat in snapshot.statistics('filename')) / 1024.0
+
+
+def instance_counts():
+    """Live instances of each game and pygame.sprite class."""
+    counts = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls.__module__ in COUNTED_MODULES:
+            counts[cls.__name__] += 1
+    return counts
+
+
+def sample(runner, round_number):
+    # gc.get_count() first: how much was pending in each generation
+    generations = gc.get_count()
+    cycles = gc.collect()
+    groups = runner.groups()
+    return {'round': round_number,
+            'tick': runner.sim.tick,
+            'rss_kib': rss_kib(),
+            'traced_kib': traced_kib(),
+            'gc_gen0': generations[0],
+            'gc_gen1': generations[1],
+            'gc_gen2': generations[2],
+            'gc_cycles': cycles,
+            'sprites': sum(groups.values()),
+            'groups': groups,
+            'instances': dict(instance_counts())}
+
+
+def flatten(entry):
+    """A sample's metrics in one dict, with the group and instance counts
+    named after their section."""
+    values = {name: value for name, value in entry.items()
+              if name not in ('round', 'tick', 'groups', 'instances') and
+              value is not None}
+    for section in ('groups', 'instances'):
+        for name, value in entry[section].items():
+            values['{}.{}'.format(section, name)] = value
+    return values
+
+
+class Series(object):
+    """Every metric over the samples so far, 8 bytes a value, so that
+    keeping them barely shows in the RSS being watched."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.length = 0
+
+    def add(self, entry):
+        values = flatten(entry)
+        for name, value in values.items():
+            if name not in self.metrics:
+                # a class first seen now had no instances before
+                self.metrics[name] = array('d', bytes(8 * self.length))
+            self.metrics[name].append(value)
+        self.length += 1
+        for name, column in self.metrics.items():
+            if len(column) < self.length:
+                column.append(0)
+
+
+# fewer measured rounds than this are too few to tell growth from noise
+MIN_ROUNDS = 20
+# how far a metric may rise between the first and last quarter of the
+# measured rounds before it counts as growth; counts may not rise at all
+ALLOWANCES = {'rss_kib': 2048, 'traced_kib': 256}
+
+
+def growth(series):
+    """(metric, first quarter mean, last quarter mean, allowance) for
+    every metric that grew by more than its allowance, from the samples
+    taken after warm-up."""
+    quarter = max(1, series.length // 4)
+    grown = []
+    for name, values in sorted(series.metrics.items()):
+        first = values[:quarter]
+        last = values[-quarter:]
+        if name.startswith('gc_'):
+            # how full a generation happened to be is not a leak; freed
+            # cycles are reported, and instances cover what they leave
+            continue
+        allowance = ALLOWANCES.get(name, 0)
+        if name in ALLOWANCES:
+            grew = (sum(last) / len(last) - sum(first) / len(first) >
+                    allowance)
+        else:
+            # a sustained rise: even the lowest late count is above every
+            # early one
+            grew = min(last) > max(first)
+        if grew:
+            grown.append((name, sum(first) / float(len(first)),
+                          sum(last) / float(len(last)), allowance))
+    return grown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='rounds played before measuring, so caches '
+                             'fill up (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frontend', action='store_true',
+                        help='play through the front end, drawing every '
+                             'frame, rather than the bare Simulation')
+    parser.add_argument('--ticks-per-frame', type=int, default=2,
+                        help='simulation ticks per drawn frame with '
+                             '--frontend (default %(default)s)')
+    parser.add_argument('--report-every', type=int, default=50,
+                        help='print a sample every this many rounds')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write every sample to PATH, one JSON object '
+                             'per line')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    if args.frontend:
+        runner = FrontEndRunner(args.seed, args.ticks_per_frame)
+    else:
+        runner = SimulationRunner(args.seed)
+    for _ in range(args.warmup):
+        runner.play_round()
+    gc.collect()
+    baseline = tracemalloc.take_snapshot()
+
+    series = Series()
+    output = open(args.output, 'w') if args.output else None
+    print('{:>7}{:>10}{:>10}{:>12}{:>9}{:>8}'.format(
+        'round', 'tick', 'rss KiB', 'traced KiB', 'sprites', 'cycles'))
+    try:
+        for number in range(1, args.rounds + 1):
+            runner.play_round()
+            entry = sample(runner, number)
+            series.add(entry)
+            if output:
+                output.write(json.dumps(entry, sort_keys=True) + '\n')
+            if number % args.report_every == 0 or number == args.rounds:
+                print('{round:>7}{tick:>10}{rss:>10}{traced_kib:>12.1f}'
+                      '{sprites:>9}{gc_cycles:>8}'.format(
+                          rss=entry['rss_kib'] or '-', **entry))
+    finally:
+        if output:
+            output.close()
+
+    if series.length < MIN_ROUNDS:
+        print('too few rounds to judge growth; measure at least {}'.format(
+            MIN_ROUNDS))
+        return
+    grown = growth(series)
+    if not grown:
+        print('flat over {} rounds'.format(args.rounds))
+        return
+    for name, first, last, allowance in grown:
+        print('GROWTH {:<32}{:12.1f} -> {:12.1f} (allowed {})'.format(
+            name, first, last, allowance))
+    print('largest tracemalloc growth since warm-up:')
+    for stat in tracemalloc.take_snapshot().compare_to(baseline,
+                                                       'lineno')[:10]:
+        print('  {}'.format(stat))
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
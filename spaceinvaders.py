@@ -1,13 +1,30 @@
+import argparse
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
 import pygame
+import queue
+import random
+import struct
 import sys
+import threading
+import tracemalloc
+import zlib
+from collections import defaultdict
+from functools import lru_cache
 from pygame import *
 from os.path import abspath, dirname
-from random import randint, choice
+from time import perf_counter
 
 # shortcut to file paths
 BASE_PATH = abspath(dirname(__file__))
 IMAGE_PATH = BASE_PATH + '/images/'
 SOUND_PATH = BASE_PATH + '/sounds/'
+FONT = BASE_PATH + '/fonts/space_invaders.ttf'
+# decoded images and samples baked by --bake-assets, used when present
+BUNDLE_PATH = BASE_PATH + '/assets.bin'
 
 # Colors (R, G, B)
 WHITE = (255, 255, 255)
@@ -17,220 +34,626 @@ BLUE = (80, 255, 239)
 PURPLE = (203, 0, 255)
 RED = (237, 28, 36)
 PINK = (255, 192, 203)
-SCREEN = display.set_mode((800, 600))
-FONT = 'fonts/space_invaders.ttf'
+
+# Logical size of the screen. The game is laid out and drawn at this size,
+# and each finished frame is scaled to the window in one pass
+SCREEN_SIZE = (800, 600)
+
+# Simulation rate; game time advances by one tick per call to Simulation.step
+TICK_RATE = 120
+# Default cap on frames drawn per second; 0 draws as fast as possible
+FRAME_RATE = 60
+# Most ticks run in one frame; past this the game slows down instead of
+# stalling to catch up
+MAX_TICKS_PER_FRAME = 12
+
+# Per-tick control bits fed to Simulation.step
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_FIRE = 4
+
+# Event types the front end reacts to; SDL drops every other kind (mouse
+# motion, most window events and text events) before it reaches the queue
+GAME_EVENTS = [QUIT, KEYDOWN, KEYUP]
+# Window events after which the whole window is drawn again, as it may have
+# been covered or hidden
+EXPOSE_EVENTS = [VIDEOEXPOSE, WINDOWEXPOSED, WINDOWSHOWN, WINDOWRESTORED]
+
+# frequency, sample size, channels and buffer size for the mixer
+MIXER_SETTINGS = (44100, -16, 1, 4096)
 
 
 class Ship(sprite.Sprite):
-    def __init__(self):
+    def __init__(self, tick_rate=TICK_RATE):
         sprite.Sprite.__init__(self)
         self.image = IMAGES['ship']
         self.rect = self.image.get_rect(topleft=(375, 540))
-        self.speed = 5
+        # pixels per second
+        self.speed = 300
+        self.tick_rate = tick_rate
+        # x in 1/tick_rate pixels, so a per-second speed moves exactly the
+        # same distance at any tick rate; and where it was a tick ago
+        self.fine_x = self.prev_x = self.rect.x * tick_rate
+
+    def update(self, controls, *args):
+        self.prev_x = self.fine_x
+        if controls & INPUT_LEFT and self.rect.x > 10:
+            self.fine_x -= self.speed
+        if controls & INPUT_RIGHT and self.rect.x < 740:
+            self.fine_x += self.speed
+        self.rect.x = self.fine_x // self.tick_rate
+
+    def draw_position(self, alpha):
+        """Where to draw the ship alpha of the way from its previous tick to
+        the current one."""
+        x = self.prev_x + (self.fine_x - self.prev_x) * alpha
+        return int(x / self.tick_rate + 0.5), self.rect.y
+
+
+class Bullet(object):
+    """A shot handed out by a BulletPool. Only the pool creates these."""
+    __slots__ = ('pool', 'rect', 'side', 'fine_y', 'prev_y')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.rect = Rect((0, 0), pool.image.get_size())
+        self.side = 'center'
+        # y in 1/tick_rate pixels, now and a tick ago
+        self.fine_y = self.prev_y = 0
+
+    @property
+    def direction(self):
+        return self.pool.direction
 
-    def update(self, keys, *args):
-        if keys[K_LEFT] and self.rect.x > 10:
-            self.rect.x -= self.speed
-        if keys[K_RIGHT] and self.rect.x < 740:
-            self.rect.x += self.speed
-        game.screen.blit(self.image, self.rect)
+    @property
+    def image(self):
+        return self.pool.image
 
+    def kill(self):
+        self.pool.release(self)
 
-class Bullet(sprite.Sprite):
-    def __init__(self, xpos, ypos, direction, speed, filename, side):
-        sprite.Sprite.__init__(self)
+
+class BulletPool(object):
+    """A fixed set of preallocated shots that share an image, speed and
+    direction.
+
+    acquire() and release() are O(1) and allocate nothing, and update() moves
+    every live shot in one pass. Live shots are kept in firing order, and the
+    pool supports enough of the sprite.Group interface (len, iteration,
+    has) for the collision code.
+    """
+
+    def __init__(self, filename, speed, direction, capacity,
+                 tick_rate=TICK_RATE):
         self.image = IMAGES[filename]
-        self.rect = self.image.get_rect(topleft=(xpos, ypos))
+        self.filename = filename
+        # pixels per second
         self.speed = speed
         self.direction = direction
-        self.side = side
-        self.filename = filename
+        self.tick_rate = tick_rate
+        self.capacity = capacity
+        self.free = [Bullet(self) for _ in range(capacity)]
+        self.active = {}
+        self._expired = []
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        return iter(list(self.active))
+
+    def has(self, bullet):
+        return bullet in self.active
+
+    def acquire(self, xpos, ypos, side='center'):
+        """Fire a shot from (xpos, ypos); returns None when the pool is
+        exhausted."""
+        if not self.free:
+            return None
+        bullet = self.free.pop()
+        bullet.rect.topleft = (xpos, ypos)
+        bullet.fine_y = bullet.prev_y = ypos * self.tick_rate
+        bullet.side = side
+        self.active[bullet] = None
+        return bullet
+
+    def release(self, bullet):
+        if bullet in self.active:
+            del self.active[bullet]
+            self.free.append(bullet)
+
+    def empty(self):
+        for bullet in list(self.active):
+            self.release(bullet)
+
+    def update(self):
+        step = self.speed * self.direction
+        tick_rate = self.tick_rate
+        expired = self._expired
+        for bullet in self.active:
+            rect = bullet.rect
+            bullet.prev_y = bullet.fine_y
+            bullet.fine_y += step
+            rect.y = bullet.fine_y // tick_rate
+            if rect.y < 15 or rect.y > 600:
+                expired.append(bullet)
+        if expired:
+            for bullet in expired:
+                self.release(bullet)
+            del expired[:]
+
+    def draw_items(self, alpha=1.0):
+        """(bullet, image, position) for each live shot, alpha of the way
+        from its previous tick to the current one."""
+        image = self.image
+        tick_rate = float(self.tick_rate)
+        for bullet in self.active:
+            y = bullet.prev_y + (bullet.fine_y - bullet.prev_y) * alpha
+            yield bullet, image, (bullet.rect.x, int(y / tick_rate + 0.5))
+
+
+class LazyDict(dict):
+    """A dict that builds a missing entry with factory(key) on first use."""
+
+    def __init__(self, factory):
+        dict.__init__(self)
+        self.factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self.factory(key)
+        return value
 
-    def update(self, keys, *args):
-        game.screen.blit(self.image, self.rect)
-        self.rect.y += self.speed * self.direction
-        if self.rect.y < 15 or self.rect.y > 600:
-            self.kill()
 
-
-# used to store images
 IMG_NAMES = ['ship', 'mystery',
              'alien1_1', 'alien1_2',
              'alien2_1', 'alien2_2',
              'alien3_1', 'alien3_2',
              'explosionblue', 'explosiongreen', 'explosionpurple',
              'laser', 'alienlaser']
-IMAGES = {name: image.load('images/{}.png'.format(name)).convert_alpha()
-          for name in IMG_NAMES}
-
+# file in images/ for each image name
+IMAGE_FILES = dict({name: name + '.png' for name in IMG_NAMES},
+                   background='background.jpg')
+
+
+def load_image(name):
+    """Decode an image, from the asset bundle when it holds a current copy,
+    and convert it for the display if one is open."""
+    filename = IMAGE_FILES[name]
+    path = IMAGE_PATH + filename
+    bundle = get_bundle()
+    surface = bundle.image(name, path) if bundle else None
+    if surface is None:
+        surface = image.load(path)
+    if display.get_surface() is None:
+        return surface
+    if filename.endswith('.jpg'):
+        return surface.convert()
+    return surface.convert_alpha()
+
+
+def scale_image(key):
+    name, size = key
+    return transform.scale(IMAGES[name], size)
+
+
+# images are decoded on first use, so importing this module loads nothing
+IMAGES = LazyDict(load_image)
+
+# every scaled variant the game draws, built once on first use and shared
+# by all sprites
+ATLAS_SIZES = [('alien1_1', (40, 35)), ('alien1_2', (40, 35)),
+               ('alien2_1', (40, 35)), ('alien2_2', (40, 35)),
+               ('alien3_1', (40, 35)), ('alien3_2', (40, 35)),
+               ('explosionblue', (40, 35)), ('explosionblue', (50, 45)),
+               ('explosiongreen', (40, 35)), ('explosiongreen', (50, 45)),
+               ('explosionpurple', (40, 35)), ('explosionpurple', (50, 45)),
+               ('mystery', (75, 35)),
+               ('ship', (23, 23)),
+               # title screen icons
+               ('alien3_1', (40, 40)), ('alien2_2', (40, 40)),
+               ('alien1_2', (40, 40)), ('mystery', (80, 40))]
+ATLAS = LazyDict(scale_image)
+
+
+class AlienGroup(object):
+    """The invader formation, stored as arrays with one entry per alien.
+
+    Aliens are numbered row by row. Every alien marches in step, so the whole
+    formation advances with a single vectorized update per move.
+
+    Kills keep per-column and per-row alive counts, the lowest living row
+    of each column and a swap-remove list of living columns up to date, so
+    picking a shooter, finding the edges and the bounds never scan the
+    formation however large it is.
+    """
+    width = 40
+    height = 35
+    x_spacing = 50
+    y_spacing = 45
+    # alien image pair for each of the five row types
+    row_images = {0: ['1_2', '1_1'],
+                  1: ['2_2', '2_1'],
+                  2: ['2_2', '2_1'],
+                  3: ['3_1', '3_2'],
+                  4: ['3_1', '3_2'],
+                  }
+    # move_time once the living aliens are down to each count; an emptied
+    # formation waiting for the next round drops back to the middle tier
+    speed_tiers = {10: 400, 1: 200, 0: 400}
 
-class Aliens(sprite.Sprite):
-    def __init__(self, row, column):
-        sprite.Sprite.__init__(self)
-        self.row = row
-        self.column = column
-        self.images = []
-        self.load_images()
-        self.index = 0
-        self.image = self.images[self.index]
-        self.rect = self.image.get_rect()
+    def __init__(self, columns, rows, xpos, ypos, current_time, rng,
+                 scale=1):
+        self.rng = rng
+        self.columns = columns
+        self.rows = rows
+        if scale != 1:
+            # aliens and the gaps between them shrink or grow together, so
+            # more columns fit in the same march
+            self.width = round(self.width * scale)
+            self.height = round(self.height * scale)
+            self.x_spacing = round(self.x_spacing * scale)
+            self.y_spacing = round(self.y_spacing * scale)
+        self.row, self.column = (a.ravel() for a in
+                                 np.indices((rows, columns), dtype=np.int32))
+        self.x = xpos + self.column * self.x_spacing
+        self.y = ypos + self.row * self.y_spacing
+        # Rows past the fifth repeat the bottom row type
+        self.kind = np.minimum(self.row, 4)
+        self.alive = np.ones(rows * columns, dtype=bool)
+        self.phase = np.zeros(rows * columns, dtype=np.int8)
+        self.count = rows * columns
+        size = (self.width, self.height)
+        self.frames = [[ATLAS['alien{}'.format(img_num), size]
+                        for img_num in self.row_images[kind]]
+                       for kind in range(5)]
         self.direction = 1
         self.right_moves = 30
         self.left_moves = 30
         self.move_number = 15
         self.move_time = 600
-        self.timer = time.get_ticks()
+        self.timer = current_time
+        self.left_add_move = 0
+        self.right_add_move = 0
+        self._column_counts = [rows] * columns
+        self._row_counts = [columns] * rows
+        # lowest living row in each column, valid while the column lives
+        self._bottom_rows = [rows - 1] * columns
+        self._top_row = 0
+        self._bottom_row = rows - 1
+        # living columns in no particular order; _column_slots[column] is
+        # a column's position in the list
+        self._alive_columns = list(range(columns))
+        self._column_slots = list(range(columns))
+        self._left_alive_column = 0
+        self._right_alive_column = columns - 1
+        self._left_killed_columns = 0
+        self._right_killed_columns = 0
+        for count, move_time in sorted(self.speed_tiers.items(),
+                                       reverse=True):
+            if self.count <= count:
+                self.move_time = move_time
+        self.update_bounds()
+
+    def __len__(self):
+        return self.count
 
-    def update(self, keys, current_time, aliens):
+    def update(self, current_time):
         if self.move_time < current_time - self.timer:
             if self.direction == 1:
-                max_move = self.right_moves + aliens.right_add_move
+                max_move = self.right_moves + self.right_add_move
             else:
-                max_move = self.left_moves + aliens.left_add_move
+                max_move = self.left_moves + self.left_add_move
 
             if self.move_number >= max_move:
                 if self.direction == 1:
-                    self.left_moves = 30 + aliens.right_add_move
+                    self.left_moves = 30 + self.right_add_move
                 elif self.direction == -1:
-                    self.right_moves = 30 + aliens.left_add_move
+                    self.right_moves = 30 + self.left_add_move
                 self.direction *= -1
                 self.move_number = 0
-                self.rect.y += 35
-            elif self.direction == 1:
-                self.rect.x += 10
-                self.move_number += 1
-            elif self.direction == -1:
-                self.rect.x -= 10
+                self.y += 35
+            else:
+                self.x += 10 * self.direction
                 self.move_number += 1
 
-            self.index += 1
-            if self.index >= len(self.images):
-                self.index = 0
-            self.image = self.images[self.index]
-
+            self.phase ^= 1
             self.timer += self.move_time
-
-        game.screen.blit(self.image, self.rect)
-
-    def load_images(self):
-        images = {0: ['1_2', '1_1'],
-                  1: ['2_2', '2_1'],
-                  2: ['2_2', '2_1'],
-                  3: ['3_1', '3_2'],
-                  4: ['3_1', '3_2'],
-                  }
-        img1, img2 = (IMAGES['alien{}'.format(img_num)] for img_num in
-                      images[self.row])
-        self.images.append(transform.scale(img1, (40, 35)))
-        self.images.append(transform.scale(img2, (40, 35)))
-
-
-class AlienGroup(sprite.Group):
-    def __init__(self, columns, rows):
-        sprite.Group.__init__(self)
-        self.aliens = [[0] * columns for _ in range(rows)]
-        self.columns = columns
-        self.rows = rows
-        self.left_add_move = 0
-        self.right_add_move = 0
-        self._alive_columns = list(range(columns))
-        self._left_alive_column = 0
-        self._right_alive_column = columns - 1
-        self._left_killed_columns = 0
-        self._right_killed_columns = 0
-
-    def add(self, *sprites):
-        super(sprite.Group, self).add(*sprites)
-
-        for s in sprites:
-            self.aliens[s.row][s.column] = s
+            self.update_bounds()
+
+    def update_bounds(self):
+        """Recompute the rect enclosing every living alien from the outer
+        living columns and rows."""
+        if self.count == 0:
+            self.bounds = Rect(0, 0, 0, 0)
+            return
+        # every alien moves in step, so alien 0 anchors the grid
+        left = int(self.x[0]) + self._left_alive_column * self.x_spacing
+        top = int(self.y[0]) + self._top_row * self.y_spacing
+        self.bounds = Rect(
+            left, top,
+            (self._right_alive_column - self._left_alive_column) *
+            self.x_spacing + self.width,
+            (self._bottom_row - self._top_row) * self.y_spacing + self.height)
+
+    def collide_rect(self, rect):
+        """Indices of the living aliens overlapping rect, in row order.
+
+        The formation is itself a uniform grid, so only the cells rect can
+        reach are looked at.
+        """
+        if not self.bounds.colliderect(rect):
+            return ()
+        left = int(self.x[0])
+        top = int(self.y[0])
+        first_column = max(0, (rect.left - left - self.width) //
+                           self.x_spacing + 1)
+        last_column = min(self.columns - 1,
+                          (rect.right - 1 - left) // self.x_spacing)
+        first_row = max(0, (rect.top - top - self.height) //
+                        self.y_spacing + 1)
+        last_row = min(self.rows - 1,
+                       (rect.bottom - 1 - top) // self.y_spacing)
+        if first_column > last_column or first_row > last_row:
+            return ()
+        cells = self.alive.reshape(self.rows, self.columns)[
+            first_row:last_row + 1, first_column:last_column + 1]
+        rows, columns = np.nonzero(cells)
+        return ((rows + first_row) * self.columns +
+                columns + first_column).tolist()
+
+    def rect(self, index):
+        return Rect(int(self.x[index]), int(self.y[index]),
+                    self.width, self.height)
+
+    def image(self, index):
+        """The animation frame alien index is showing."""
+        return self.frames[self.kind[index]][self.phase[index]]
+
+    def draw_items(self):
+        """(index, image, position) for each living alien."""
+        index = np.flatnonzero(self.alive)
+        frames = self.frames
+        for i, kind, phase, x, y in zip(index.tolist(),
+                                        self.kind[index].tolist(),
+                                        self.phase[index].tolist(),
+                                        self.x[index].tolist(),
+                                        self.y[index].tolist()):
+            yield i, frames[kind][phase], (x, y)
 
     def is_column_dead(self, column):
-        for row in range(self.rows):
-            if self.aliens[row][column]:
-                return False
-        return True
+        return not self._column_counts[column]
 
     @property
     def random_bottom(self):
-        random_index = randint(0, len(self._alive_columns) - 1)
+        """Index of the lowest living alien in a random column."""
+        if not self._alive_columns:
+            return None
+        random_index = self.rng.randint(0, len(self._alive_columns) - 1)
         col = self._alive_columns[random_index]
-        for row in range(self.rows, 0, -1):
-            enemy = self.aliens[row - 1][col]
-            if enemy:
-                return enemy
-        return None
+        return self._bottom_rows[col] * self.columns + col
 
-    def kill(self, alien):
+    def kill(self, index):
         # on double hit calls twice for same enemy, so check before
-        if not self.aliens[alien.row][alien.column]:
+        if not self.alive[index]:
             return  # nothing to kill
 
-        self.aliens[alien.row][alien.column] = None
-        is_column_dead = self.is_column_dead(alien.column)
-        if is_column_dead:
-            self._alive_columns.remove(alien.column)
-
-        if alien.column == self._right_alive_column:
+        self.alive[index] = False
+        self.count -= 1
+        self.move_time = self.speed_tiers.get(self.count, self.move_time)
+        columns = self.columns
+        column = index % columns
+        row = index // columns
+        column_counts = self._column_counts
+        column_counts[column] -= 1
+        self._row_counts[row] -= 1
+
+        if column_counts[column]:
+            # each row is stepped over at most once per column, so this
+            # is constant time spread over the round
+            if row == self._bottom_rows[column]:
+                alive = self.alive
+                while not alive[row * columns + column]:
+                    row -= 1
+                self._bottom_rows[column] = row
+        else:
+            # swap the last living column into this one's slot
+            alive_columns = self._alive_columns
+            slot = self._column_slots[column]
+            last = alive_columns.pop()
+            if last != column:
+                alive_columns[slot] = last
+                self._column_slots[last] = slot
+
+        if self.count:
+            row_counts = self._row_counts
+            while not row_counts[self._top_row]:
+                self._top_row += 1
+            while not row_counts[self._bottom_row]:
+                self._bottom_row -= 1
+
+        is_column_dead = not column_counts[column]
+        if column == self._right_alive_column:
             while self._right_alive_column > 0 and is_column_dead:
                 self._right_alive_column -= 1
                 self._right_killed_columns += 1
                 self.right_add_move = self._right_killed_columns * 5
-                is_column_dead = self.is_column_dead(self._right_alive_column)
+                is_column_dead = not column_counts[self._right_alive_column]
 
-        elif alien.column == self._left_alive_column:
-            while self._left_alive_column < self.columns and is_column_dead:
+        elif column == self._left_alive_column:
+            while self._left_alive_column < columns and is_column_dead:
                 self._left_alive_column += 1
                 self._left_killed_columns += 1
                 self.left_add_move = self._left_killed_columns * 5
-                is_column_dead = self.is_column_dead(self._left_alive_column)
+                is_column_dead = (self._left_alive_column < columns and
+                                  not column_counts[self._left_alive_column])
+        self.update_bounds()
+
+    def reindex(self, alive_columns):
+        """Rebuild the kill bookkeeping after alive was written directly,
+        keeping living columns in the given order so shooters are picked as
+        they would have been."""
+        alive = self.alive.reshape(self.rows, self.columns)
+        self._column_counts = alive.sum(axis=0).tolist()
+        self._row_counts = alive.sum(axis=1).tolist()
+        self._bottom_rows = (self.rows - 1 -
+                             alive[::-1].argmax(axis=0)).tolist()
+        rows = np.flatnonzero(self._row_counts)
+        if len(rows):
+            self._top_row = int(rows[0])
+            self._bottom_row = int(rows[-1])
+        self._alive_columns = list(alive_columns)
+        for slot, column in enumerate(self._alive_columns):
+            self._column_slots[column] = slot
+        self.update_bounds()
+
+
+def rect_mask(size):
+    """A solid mask of the given size, shared between callers."""
+    if size not in RECT_MASKS:
+        RECT_MASKS[size] = mask.Mask(size, fill=True)
+    return RECT_MASKS[size]
+
+
+def image_mask(image):
+    """The mask of an image's opaque pixels, built once per surface.
+
+    Sprites share their images (one surface per picture, animation frame
+    and scale), so this only ever holds a handful of masks.
+    """
+    found = IMAGE_MASKS.get(image)
+    if found is None:
+        found = IMAGE_MASKS[image] = mask.from_surface(image)
+    return found
+
+
+def make_crater(width, height):
+    """An elliptical blast mask."""
+    crater = mask.Mask((width, height))
+    for x in range(width):
+        for y in range(height):
+            dx = (x - (width - 1) / 2.0) / (width / 2.0)
+            dy = (y - (height - 1) / 2.0) / (height / 2.0)
+            if dx * dx + dy * dy <= 1:
+                crater.set_at((x, y))
+    return crater
+
+
+RECT_MASKS = {}
+IMAGE_MASKS = {}
+# Damage a shot does to a bunker, centred on the point of impact. It is
+# wider than the 10px spacing of alien columns so neighbouring craters meet.
+CRATER = make_crater(15, 11)
 
 
 class Bunker(sprite.Sprite):
-    def __init__(self, size, colour, row, column):
+    """A shield kept as a per-pixel occupancy mask that erodes where it is
+    hit, drawn with a single blit."""
+
+    def __init__(self, xpos, ypos, width, height, colour):
         sprite.Sprite.__init__(self)
-        self.height = size
-        self.width = size
         self.color = colour
-        self.image = Surface((self.width, self.height))
-        self.image.fill(self.color)
-        self.rect = self.image.get_rect()
-        self.row = row
-        self.column = column
+        self.mask = mask.Mask((width, height), fill=True)
+        self.rect = Rect(xpos, ypos, width, height)
+        self.redraw()
+
+    def redraw(self):
+        # a new surface every time: the old one may still be being drawn
+        self.image = self.render()
+        self.bits = None
+
+    def render(self):
+        """A new surface of the bunker as it stands."""
+        return self.mask.to_surface(setcolor=self.color,
+                                    unsetcolor=(0, 0, 0, 0))
+
+    def overlap(self, rect):
+        """The part of rect covering solid pixels, relative to the bunker,
+        or None."""
+        if not self.rect.colliderect(rect):
+            return None
+        offset = (rect.x - self.rect.x, rect.y - self.rect.y)
+        if self.mask.overlap(rect_mask(rect.size), offset) is None:
+            return None
+        overlap = self.mask.overlap_mask(rect_mask(rect.size), offset)
+        return overlap.get_bounding_rects()[0]
+
+    def hit(self, rect, direction):
+        """Blast a crater where a shot travelling in direction (-1 up, 1
+        down) first meets solid pixels. Returns True if the shot hit."""
+        area = self.overlap(rect)
+        if area is None:
+            return False
+        impact_y = area.bottom - 1 if direction == -1 else area.top
+        width, height = CRATER.get_size()
+        self.mask.erase(CRATER, (area.centerx - width // 2,
+                                 impact_y - height // 2))
+        self.redraw()
+        return True
 
-    def update(self, keys, *args):
-        game.screen.blit(self.image, self.rect)
+    def erase(self, rect):
+        """Clear every pixel under rect, e.g. where aliens march through."""
+        if self.overlap(rect) is None:
+            return
+        self.mask.erase(rect_mask(rect.size),
+                        (rect.x - self.rect.x, rect.y - self.rect.y))
+        self.redraw()
+
+    def pixels(self):
+        """The solid pixels packed one bit each, column by column.
+
+        They are read from the mask, never from image, which the render
+        thread may be drawing.
+        """
+        if self.bits is None:
+            solid = self.mask.to_surface(unsetcolor=(0, 0, 0, 0))
+            self.bits = np.packbits(
+                surfarray.pixels_alpha(solid) > 0).tobytes()
+        return self.bits
+
+    def set_pixels(self, data):
+        """Make the bunker match bits from pixels()."""
+        if data == self.pixels():
+            return
+        width, height = self.rect.size
+        solid = np.unpackbits(np.frombuffer(data, np.uint8),
+                              count=width * height)
+        surface = Surface((width, height), SRCALPHA)
+        surfarray.pixels_alpha(surface)[...] = \
+            solid.reshape(width, height) * 255
+        self.mask = mask.from_surface(surface)
+        self.redraw()
 
 
 class Mystery(sprite.Sprite):
-    def __init__(self):
+    def __init__(self, current_time, tick_rate=TICK_RATE):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['mystery']
-        self.image = transform.scale(self.image, (75, 35))
+        self.image = ATLAS['mystery', (75, 35)]
         self.rect = self.image.get_rect(topleft=(-80, 45))
+        # pixels per second, and x in 1/tick_rate pixels as for the Ship
+        self.speed = 120
+        self.tick_rate = tick_rate
+        self.fine_x = self.prev_x = self.rect.x * tick_rate
         self.row = 5
         self.move_time = 25000
         self.direction = 1
-        self.timer = time.get_ticks()
-        self.mystery_entered = mixer.Sound(SOUND_PATH + 'mysteryentered.wav')
-        # self.mystery_entered.set_volume(0.5)
+        self.timer = current_time
         self.play_sound = True
+        # Set for the tick on which the ship starts a pass across the screen
+        self.entered = False
 
-    def update(self, keys, current_time, *args):
+    def update(self, controls, current_time, *args):
         reset_timer = False
+        self.prev_x = self.fine_x
         passed = current_time - self.timer
         if passed > self.move_time:
             if (self.rect.x < 0 or self.rect.x > 800) and self.play_sound:
-                self.mystery_entered.play()
+                self.entered = True
                 self.play_sound = False
             if self.rect.x < 840 and self.direction == 1:
-                self.mystery_entered.fadeout(4000)
-                self.rect.x += 2
-                game.screen.blit(self.image, self.rect)
+                self.fine_x += self.speed
             if self.rect.x > -100 and self.direction == -1:
-                self.mystery_entered.fadeout(4000)
-                self.rect.x -= 2
-                game.screen.blit(self.image, self.rect)
+                self.fine_x -= self.speed
+            self.rect.x = self.fine_x // self.tick_rate
 
         if self.rect.x > 830:
             self.play_sound = True
@@ -243,85 +666,311 @@ class Mystery(sprite.Sprite):
         if passed > self.move_time and reset_timer:
             self.timer = current_time
 
+    def draw_position(self, alpha):
+        x = self.prev_x + (self.fine_x - self.prev_x) * alpha
+        return int(x / self.tick_rate + 0.5), self.rect.y
+
+
+class Explosions(object):
+    """Every explosion on screen, stored as arrays with one entry each.
+
+    An explosion is a position, a kind and the time it went off. What it
+    shows at any moment comes from its kind's frame sequence, built once
+    by explosion_frames(), so a chain of kills costs no image work. Kinds
+    0 to 4 are the alien rows, then come the ship and the mystery ship.
+    Entries stay in the order they were added, and each has a serial
+    number that is never reused, so the front end can tell new ones apart.
+    """
+    SHIP = 5
+    MYSTERY = 6
+    # ms each kind lasts
+    LIFETIMES = np.array([400, 400, 400, 400, 400, 900, 600])
+    # ms each entry of a frame sequence is shown for
+    FRAME_TIME = 100
+
+    def __init__(self, capacity=16):
+        self.x = np.zeros(capacity, np.int32)
+        self.y = np.zeros(capacity, np.int32)
+        self.kind = np.zeros(capacity, np.uint8)
+        self.score = np.zeros(capacity, np.int32)
+        self.timer = np.zeros(capacity, np.int64)
+        self.serial = np.zeros(capacity, np.int64)
+        self.count = 0
+        # serial number of the next explosion added
+        self.added = 0
+
+    def arrays(self):
+        return self.x, self.y, self.kind, self.score, self.timer, self.serial
+
+    def __len__(self):
+        return self.count
+
+    def add(self, xpos, ypos, kind, score, current_time):
+        if self.count == self.x.size:
+            (self.x, self.y, self.kind, self.score, self.timer,
+             self.serial) = [np.concatenate((array, np.zeros_like(array)))
+                             for array in self.arrays()]
+        index = self.count
+        self.x[index] = xpos
+        self.y[index] = ypos
+        self.kind[index] = kind
+        self.score[index] = score
+        self.timer[index] = current_time
+        self.serial[index] = self.added
+        self.added += 1
+        self.count += 1
+
+    def empty(self):
+        self.count = 0
+
+    def update(self, current_time):
+        """Drop every explosion that has run its course, in one pass."""
+        count = self.count
+        if not count:
+            return
+        live = (current_time - self.timer[:count] <=
+                self.LIFETIMES[self.kind[:count]])
+        if live.all():
+            return
+        for array in self.arrays():
+            kept = array[:count][live]
+            array[:kept.size] = kept
+        self.count = int(np.count_nonzero(live))
+
+    def items(self):
+        """(x, y, kind, score, timer) of each explosion, oldest first."""
+        count = self.count
+        return zip(*(array[:count].tolist() for array in
+                     (self.x, self.y, self.kind, self.score, self.timer)))
+
+    def draw_items(self, current_time):
+        """(serial, image, position) for each explosion that shows
+        something at current_time."""
+        count = self.count
+        # an entry is shown up to and including its last ms
+        slots = np.maximum(current_time - self.timer[:count] - 1,
+                           0) // self.FRAME_TIME
+        for serial, kind, score, x, y, slot in zip(
+                self.serial[:count].tolist(), self.kind[:count].tolist(),
+                self.score[:count].tolist(), self.x[:count].tolist(),
+                self.y[:count].tolist(), slots.tolist()):
+            frames = explosion_frames(kind, score)
+            if slot < len(frames) and frames[slot] is not None:
+                image, dx, dy = frames[slot]
+                yield serial, image, (x + dx, y + dy)
+
+
+@lru_cache(maxsize=None)
+def explosion_frames(kind, score):
+    """What an explosion of a kind shows in each FRAME_TIME of its life:
+    (image, x offset, y offset), or None while it is blinked out. The
+    mystery ship's shows the score it was worth."""
+    if kind == Explosions.MYSTERY:
+        text = (render_text(FONT, 20, str(score), WHITE), 20, 6)
+        return text, text, None, None, text, text
+    if kind == Explosions.SHIP:
+        ship = (IMAGES['ship'], 0, 0)
+        return None, None, None, ship, ship, ship
+    name = 'explosion' + ['purple', 'blue', 'blue', 'green', 'green'][kind]
+    return (ATLAS[name, (40, 35)], 0, 0), (ATLAS[name, (50, 45)], -6, -6)
+
 
-class Explosion(sprite.Sprite):
-    def __init__(self, xpos, ypos, row, ship, mystery, score):
+class Life(sprite.Sprite):
+    def __init__(self, xpos, ypos):
         sprite.Sprite.__init__(self)
-        self.is_mystery = mystery
-        self.is_ship = ship
-        if mystery:
-            self.text = Text(FONT, 20, str(score), WHITE, xpos + 20, ypos + 6)
-        elif ship:
-            self.image = IMAGES['ship']
-            self.rect = self.image.get_rect(topleft=(xpos, ypos))
-        else:
-            self.row = row
-            self.load_image()
-            self.image = transform.scale(self.image, (40, 35))
-            self.rect = self.image.get_rect(topleft=(xpos, ypos))
-            game.screen.blit(self.image, self.rect)
+        self.image = ATLAS['ship', (23, 23)]
+        self.rect = self.image.get_rect(topleft=(xpos, ypos))
 
-        self.timer = time.get_ticks()
 
-    def update(self, keys, current_time):
-        passed = current_time - self.timer
-        if self.is_mystery:
-            if passed <= 200:
-                self.text.draw(game.screen)
-            elif 400 < passed <= 600:
-                self.text.draw(game.screen)
-            elif passed > 600:
-                self.kill()
-        elif self.is_ship:
-            if 300 < passed <= 600:
-                game.screen.blit(self.image, self.rect)
-            elif passed > 900:
-                self.kill()
-        else:
-            if passed <= 100:
-                game.screen.blit(self.image, self.rect)
-            elif 100 < passed <= 200:
-                self.image = transform.scale(self.image, (50, 45))
-                game.screen.blit(self.image,
-                                 (self.rect.x - 6, self.rect.y - 6))
-            elif passed > 400:
-                self.kill()
+# font.Font objects, keyed by (path, size); opening the .ttf is not cheap
+FONTS = {}
 
-    def load_image(self):
-        imgColors = ['purple', 'blue', 'blue', 'green', 'green']
-        self.image = IMAGES['explosion{}'.format(imgColors[self.row])]
 
+def get_font(textFont, size):
+    key = (textFont, size)
+    if key not in FONTS:
+        FONTS[key] = font.Font(textFont, size)
+    return FONTS[key]
 
-class Life(sprite.Sprite):
-    def __init__(self, xpos, ypos):
-        sprite.Sprite.__init__(self)
-        self.image = IMAGES['ship']
-        self.image = transform.scale(self.image, (23, 23))
-        self.rect = self.image.get_rect(topleft=(xpos, ypos))
 
-    def update(self, keys, *args):
-        game.screen.blit(self.image, self.rect)
+@lru_cache(maxsize=256)
+def render_text(textFont, size, message, colour):
+    return get_font(textFont, size).render(message, True, colour)
 
 
 class Text(object):
     def __init__(self, textFont, size, message, colour, xpos, ypos):
-        self.font = font.Font(textFont, size)
-        self.surface = self.font.render(message, True, colour)
+        self.font = get_font(textFont, size)
+        self.surface = render_text(textFont, size, message, colour)
         self.rect = self.surface.get_rect(topleft=(xpos, ypos))
 
     def draw(self, surface):
         surface.blit(self.surface, self.rect)
 
 
-class SpaceInvaders(object):
-    def __init__(self):
-        mixer.pre_init(44100, -16, 1, 4096)
-        init()
-        self.caption = display.set_caption('Space Invaders')
-        self.screen = SCREEN
-        self.background = image.load('images/background.jpg').convert()
-        self.start_game = False
-        self.main_screen = True
+class NumberText(object):
+    """A number drawn from cached per-digit glyphs.
+
+    The blit list is only rebuilt when the value changes, so redrawing an
+    unchanged number allocates nothing.
+    """
+
+    def __init__(self, textFont, size, colour, xpos, ypos):
+        self.glyphs = {digit: render_text(textFont, size, digit, colour)
+                       for digit in '-0123456789'}
+        self.xpos = xpos
+        self.ypos = ypos
+        self.value = None
+        self.blit_list = []
+
+    def set_value(self, value):
+        if value == self.value:
+            return
+        self.value = value
+        self.blit_list = []
+        xpos = self.xpos
+        for digit in str(value):
+            glyph = self.glyphs[digit]
+            self.blit_list.append((glyph, (xpos, self.ypos)))
+            xpos += glyph.get_width()
+
+    def draw(self, surface):
+        surface.blits(self.blit_list, False)
+
+
+class SpatialHash(object):
+    """Uniform grid broadphase over sprites with a rect.
+
+    Moving sprites are re-added every tick after clear(); sprites that never
+    move can be added once with static=True. A query only tests the sprites
+    sharing a cell with the rect it is given, so its cost follows the number
+    of nearby objects rather than the size of the groups.
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.static_cells = defaultdict(list)
+
+    def clear(self, static=False):
+        self.cells.clear()
+        if static:
+            self.static_cells.clear()
+
+    def add(self, *groups, **kwargs):
+        size = self.cell_size
+        cells = self.static_cells if kwargs.get('static') else self.cells
+        for group in groups:
+            for item in group:
+                rect = item.rect
+                for cx in range(rect.left // size,
+                                (rect.right - 1) // size + 1):
+                    for cy in range(rect.top // size,
+                                    (rect.bottom - 1) // size + 1):
+                        cells[cx, cy].append(item)
+
+    def query(self, rect):
+        """Every sprite overlapping rect."""
+        size = self.cell_size
+        found = []
+        for cells in (self.cells, self.static_cells):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                for cy in range(rect.top // size,
+                                (rect.bottom - 1) // size + 1):
+                    cell = cells.get((cx, cy))
+                    if cell:
+                        for item in cell:
+                            if item.rect.colliderect(rect) and \
+                                    item not in found:
+                                found.append(item)
+        return found
+
+
+def no_mark(phase):
+    """Stand-in for FrameProfiler.mark while profiling is switched off."""
+
+
+# Snapshots and recordings store a seed as an unsigned 64-bit number
+SEED_LIMIT = 1 << 64
+
+
+def check_seed(seed):
+    """Return seed, or raise ValueError if a snapshot could not hold it."""
+    if not 0 <= seed < SEED_LIMIT:
+        raise ValueError('seed {} is not in [0, 2**64)'.format(seed))
+    return seed
+
+
+SNAPSHOT_MAGIC = b'SISN'
+SNAPSHOT_VERSION = 4
+# magic, version, alien columns, alien rows, alien width, alien height,
+# tick rate
+SNAPSHOT_HEADER = struct.Struct('<4sBHHHHH')
+# tick, seed, score, lives, game over, ship alive, make new ship, timer,
+# ship timer, game timer, fire timer set, fire timer, alien position start,
+# alien position; the ship's alive, x and previous x; the mystery ship's
+# alive, x, previous x, direction, timer, play sound and entered; the
+# formation's direction, move number, right moves, left moves, move time,
+# timer, left and right living columns and their killed columns, count;
+# whether the random generator holds a gauss value, and it; then how many
+# living columns, player shots, alien shots and explosions follow
+SNAPSHOT_STATE = struct.Struct('<QQiq???qqq?qii?qq?qqbq??biiiiqiiiii?dHHHH')
+# the random generator's Mersenne Twister state
+SNAPSHOT_RANDOM = struct.Struct('<625I')
+# x, y, previous y (in 1/tick_rate pixels) and side of a shot
+SNAPSHOT_BULLET = struct.Struct('<iqqB')
+BULLET_SIDES = ['center', 'left', 'right']
+# x, y, kind, score and timer of an explosion
+SNAPSHOT_EXPLOSION = struct.Struct('<iiBiq')
+
+
+class Simulation(object):
+    """Game rules for a single session, advanced one tick at a time.
+
+    Nothing in here touches the display, the mixer or the wall clock, so
+    any number of simulations can be stepped headless as fast as the CPU
+    allows. Sounds the front end should play are reported in ``events``.
+
+    All randomness comes from a per-game seed, so a seed plus the controls
+    given to each step reproduce a game exactly.
+    """
+
+    def __init__(self, alien_columns=10, alien_rows=5, bullet_limit=4,
+                 fire_interval=0, alien_fire_interval=700,
+                 alien_bullet_limit=64, dual_laser_score=None, seed=None,
+                 tick_rate=TICK_RATE, pixel_collisions=False, alien_scale=1):
+        self.tick = 0
+        self.tick_rate = tick_rate
+        # where each phase of step() starts, for the frame profiler
+        self.mark = no_mark
+        self.random = random.Random()
+        self.seed = None
+        self.events = []
+        self.alien_columns = alien_columns
+        self.alien_rows = alien_rows
+        # Size of the aliens and their spacing against the stock formation
+        self.alien_scale = alien_scale
+        # Player shots allowed on screen at once, and the minimum time
+        # between them in ms
+        self.bullet_limit = bullet_limit
+        self.fire_interval = fire_interval
+        self.alien_fire_interval = alien_fire_interval
+        self.alien_bullet_limit = alien_bullet_limit
+        # Score from which the ship fires two lasers at once, like galaga
+        self.dual_laser_score = dual_laser_score
+        # Whether shots and ships only collide where opaque pixels meet,
+        # rather than wherever their rects overlap; and how many pairs have
+        # got as far as comparing masks
+        self.pixel_collisions = pixel_collisions
+        self.mask_tests = 0
+        # A dual shot may take the last free slot and one more
+        self.bullets = BulletPool('laser', 900, -1, bullet_limit + 1,
+                                  tick_rate)
+        self.alien_bullets = BulletPool('alienlaser', 300, 1,
+                                        alien_bullet_limit, tick_rate)
+        self.explosions = Explosions()
+        self.fire_timer = None
+        self.grid = SpatialHash()
         self.game_over = False
         # Initial value for a new game
         self.alien_position_default = 65
@@ -329,16 +978,68 @@ class SpaceInvaders(object):
         self.alien_position_start = self.alien_position_default
         # Current enemy starting position
         self.alien_position = self.alien_position_start
+        self.game_timer = self.now
+        self.reset(0, 3, True, seed)
+        if pixel_collisions:
+            self.build_masks()
+
+    def build_masks(self):
+        """Make the mask of every image the narrow phase can test now, on
+        this thread. Building one locks its surface, which must not happen
+        while the render thread is drawing it."""
+        images = [self.bullets.image, self.alien_bullets.image,
+                  self.player.image, self.mystery_ship.image]
+        for frames in self.aliens.frames:
+            images += frames
+        for surface in images:
+            image_mask(surface)
 
-    def reset(self, score, lives, new_game=False):
-        self.player = Ship()
+    @property
+    def now(self):
+        """Game time in milliseconds, derived from the tick counter."""
+        return self.tick * 1000 // self.tick_rate
+
+    @property
+    def round_over(self):
+        return not self.game_over and len(self.aliens) == 0
+
+    @property
+    def rules(self):
+        """The keyword arguments that build a Simulation like this one."""
+        return dict(alien_columns=self.alien_columns,
+                    alien_rows=self.alien_rows,
+                    alien_scale=self.alien_scale,
+                    bullet_limit=self.bullet_limit,
+                    fire_interval=self.fire_interval,
+                    alien_fire_interval=self.alien_fire_interval,
+                    alien_bullet_limit=self.alien_bullet_limit,
+                    dual_laser_score=self.dual_laser_score,
+                    tick_rate=self.tick_rate,
+                    pixel_collisions=self.pixel_collisions)
+
+    def reset(self, score, lives, new_game=False, seed=None):
+        """Start a new round, or a new game with a fresh (or given) seed.
+
+        Raises ValueError for a seed check_seed() refuses.
+        """
+        if new_game:
+            if seed is None:
+                seed = random.getrandbits(63)
+            self.seed = check_seed(seed)
+            self.tick = 0
+            self.random.seed(self.seed)
+            self.alien_position_start = self.alien_position_default
+            self.game_over = False
+            self.game_timer = 0
+        current_time = self.now
+        self.player = Ship(self.tick_rate)
         self.player_group = sprite.Group(self.player)
-        self.explosions_group = sprite.Group()
-        self.bullets = sprite.Group()
-        self.mystery_ship = Mystery()
+        self.explosions.empty()
+        self.bullets.empty()
+        self.mystery_ship = Mystery(current_time, self.tick_rate)
         self.mystery_group = sprite.Group(self.mystery_ship)
-        self.alien_bullets = sprite.Group()
-        self.reset_lives(lives)
+        self.alien_bullets.empty()
+        self.fire_timer = None
         self.alien_position = self.alien_position_start
         self.make_aliens()
         # Only create bunkers for a new game, not a new round
@@ -347,28 +1048,1684 @@ class SpaceInvaders(object):
                                             self.make_bunkers(1),
                                             self.make_bunkers(2),
                                             self.make_bunkers(3))
-        self.keys = key.get_pressed()
-        self.clock = time.Clock()
-        self.timer = time.get_ticks()
-        self.note_timer = time.get_ticks()
-        self.ship_timer = time.get_ticks()
+            self.grid.clear(static=True)
+            self.grid.add(self.allBlockers, static=True)
+        self.timer = current_time
+        self.ship_timer = current_time
         self.score = score
         self.lives = lives
-        self.create_audio()
-        self.create_text()
         self.make_new_ship = False
         self.ship_alive = True
 
+    def state_hash(self):
+        """Digest of everything that decides how the game plays on."""
+        aliens = self.aliens
+        mystery = self.mystery_ship
+        state = (self.tick, self.score, self.lives, self.game_over,
+                 self.ship_alive, self.make_new_ship, self.timer,
+                 self.ship_timer, self.game_timer, self.fire_timer,
+                 self.alien_position_start, self.player.rect.topleft,
+                 mystery.rect.topleft, mystery.direction, mystery.timer,
+                 mystery.play_sound, aliens.direction, aliens.move_number,
+                 aliens.right_moves, aliens.left_moves, aliens.move_time,
+                 aliens.timer, aliens.left_add_move, aliens.right_add_move,
+                 [bullet.rect.topleft for bullet in self.bullets],
+                 [bullet.rect.topleft for bullet in self.alien_bullets],
+                 [((x, y), timer)
+                  for x, y, _, _, timer in self.explosions.items()],
+                 self.random.getstate(),
+                 # where the ships and shots are between whole pixels
+                 self.player.fine_x, mystery.fine_x,
+                 [bullet.fine_y for pool in (self.bullets, self.alien_bullets)
+                  for bullet in pool])
+        digest = hashlib.sha256(repr(state).encode())
+        for array in (aliens.x, aliens.y, aliens.alive, aliens.phase):
+            digest.update(array.tobytes())
+        for blocker in self.allBlockers:
+            # rendered afresh, as the render thread may be drawing image
+            digest.update(image.tobytes(blocker.render(), 'RGBA'))
+        return digest.hexdigest()
+
+    def snapshot(self):
+        """Everything state_hash() covers, packed into a few KiB of bytes.
+
+        restore() puts this or any Simulation with the same alien columns,
+        rows, alien scale and tick rate, and room for as many shots, back in
+        exactly that state.
+        """
+        aliens = self.aliens
+        player = self.player
+        mystery = self.mystery_ship
+        _, random_state, gauss = self.random.getstate()
+        bullets = [(pool, bullet) for pool in (self.bullets,
+                                               self.alien_bullets)
+                   for bullet in pool]
+        parts = [
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                 self.alien_columns, self.alien_rows,
+                                 aliens.width, aliens.height, self.tick_rate),
+            SNAPSHOT_STATE.pack(
+                self.tick, self.seed, self.score, self.lives, self.game_over,
+                self.ship_alive, self.make_new_ship, self.timer,
+                self.ship_timer, self.game_timer,
+                self.fire_timer is not None, self.fire_timer or 0,
+                self.alien_position_start, self.alien_position,
+                player.alive(), player.fine_x, player.prev_x,
+                mystery.alive(), mystery.fine_x, mystery.prev_x,
+                mystery.direction, mystery.timer, mystery.play_sound,
+                mystery.entered, aliens.direction, aliens.move_number,
+                aliens.right_moves, aliens.left_moves, aliens.move_time,
+                aliens.timer, aliens._left_alive_column,
+                aliens._right_alive_column, aliens._left_killed_columns,
+                aliens._right_killed_columns, aliens.count,
+                gauss is not None, gauss or 0.0,
+                len(aliens._alive_columns), len(self.bullets),
+                len(self.alien_bullets), len(self.explosions)),
+            SNAPSHOT_RANDOM.pack(*random_state),
+            aliens.x.tobytes(), aliens.y.tobytes(), aliens.alive.tobytes(),
+            aliens.phase.tobytes(),
+            np.array(aliens._alive_columns, np.uint16).tobytes()]
+        parts += [SNAPSHOT_BULLET.pack(bullet.rect.x, bullet.fine_y,
+                                       bullet.prev_y,
+                                       BULLET_SIDES.index(bullet.side))
+                  for pool, bullet in bullets]
+        parts += [SNAPSHOT_EXPLOSION.pack(*explosion)
+                  for explosion in self.explosions.items()]
+        parts += [blocker.pixels() for blocker in self.allBlockers]
+        return b''.join(parts)
+
+    def restore(self, data):
+        """Return to the state a snapshot() was taken in.
+
+        Raises ValueError, leaving this simulation as it was, for a
+        snapshot it cannot hold.
+        """
+        if len(data) < SNAPSHOT_HEADER.size + SNAPSHOT_STATE.size:
+            raise ValueError('snapshot is truncated')
+        magic, version, columns, rows, width, height, tick_rate = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('not a version {} snapshot'.format(
+                SNAPSHOT_VERSION))
+        aliens = self.aliens
+        if (columns, rows, width, height, tick_rate) != (
+                self.alien_columns, self.alien_rows, aliens.width,
+                aliens.height, self.tick_rate):
+            raise ValueError('snapshot of a {}x{} formation of {}x{} aliens '
+                             'at {} ticks/s'.format(columns, rows, width,
+                                                    height, tick_rate))
+        offset = SNAPSHOT_HEADER.size
+        state = SNAPSHOT_STATE.unpack_from(data, offset)
+        alive_columns, bullets, alien_bullets, explosions = state[-4:]
+        for pool, count in ((self.bullets, bullets),
+                            (self.alien_bullets, alien_bullets)):
+            if count > pool.capacity:
+                raise ValueError('snapshot has {} {} shots in flight, more '
+                                 'than the {} this simulation allows'.format(
+                                     count, pool.filename, pool.capacity))
+        size = (offset + SNAPSHOT_STATE.size + SNAPSHOT_RANDOM.size +
+                sum(array.nbytes for array in
+                    (aliens.x, aliens.y, aliens.alive, aliens.phase)) +
+                alive_columns * 2 +
+                (bullets + alien_bullets) * SNAPSHOT_BULLET.size +
+                explosions * SNAPSHOT_EXPLOSION.size +
+                sum((blocker.rect.width * blocker.rect.height + 7) // 8
+                    for blocker in self.allBlockers))
+        if len(data) != size:
+            raise ValueError('snapshot is {} bytes, expected {}'.format(
+                len(data), size))
+        (self.tick, self.seed, self.score, self.lives, self.game_over,
+         self.ship_alive, self.make_new_ship, self.timer, self.ship_timer,
+         self.game_timer, has_fire_timer, fire_timer,
+         self.alien_position_start, self.alien_position,
+         player_alive, player_x, player_prev_x,
+         mystery_alive, mystery_x, mystery_prev_x, mystery_direction,
+         mystery_timer, mystery_play_sound, mystery_entered,
+         alien_direction, move_number, right_moves, left_moves, move_time,
+         alien_timer, left_alive_column, right_alive_column,
+         left_killed_columns, right_killed_columns, alien_count,
+         has_gauss, gauss, alive_columns, bullets, alien_bullets,
+         explosions) = state
+        offset += SNAPSHOT_STATE.size
+        self.fire_timer = fire_timer if has_fire_timer else None
+        self.random.setstate((3, SNAPSHOT_RANDOM.unpack_from(data, offset),
+                              gauss if has_gauss else None))
+        offset += SNAPSHOT_RANDOM.size
+        del self.events[:]
+
+        tick_rate = self.tick_rate
+        player = self.player
+        player.fine_x = player_x
+        player.prev_x = player_prev_x
+        player.rect.x = player_x // tick_rate
+        mystery = self.mystery_ship
+        mystery.fine_x = mystery_x
+        mystery.prev_x = mystery_prev_x
+        mystery.rect.x = mystery_x // tick_rate
+        mystery.direction = mystery_direction
+        mystery.timer = mystery_timer
+        mystery.play_sound = mystery_play_sound
+        mystery.entered = mystery_entered
+        for group in (self.player_group, self.mystery_group,
+                      self.all_sprites):
+            group.empty()
+        if player_alive:
+            self.player_group.add(player)
+            self.all_sprites.add(player)
+        if mystery_alive:
+            self.mystery_group.add(mystery)
+            self.all_sprites.add(mystery)
+
+        for array in (aliens.x, aliens.y, aliens.alive, aliens.phase):
+            array[:] = np.frombuffer(data, array.dtype, array.size, offset)
+            offset += array.nbytes
+        aliens.direction = alien_direction
+        aliens.move_number = move_number
+        aliens.right_moves = right_moves
+        aliens.left_moves = left_moves
+        aliens.move_time = move_time
+        aliens.timer = alien_timer
+        aliens._left_alive_column = left_alive_column
+        aliens._right_alive_column = right_alive_column
+        aliens._left_killed_columns = left_killed_columns
+        aliens._right_killed_columns = right_killed_columns
+        aliens.left_add_move = left_killed_columns * 5
+        aliens.right_add_move = right_killed_columns * 5
+        aliens.count = alien_count
+        aliens.reindex(np.frombuffer(data, np.uint16, alive_columns,
+                                     offset).tolist())
+        offset += alive_columns * 2
+
+        for pool, count in ((self.bullets, bullets),
+                            (self.alien_bullets, alien_bullets)):
+            pool.empty()
+            for _ in range(count):
+                x, fine_y, prev_y, side = \
+                    SNAPSHOT_BULLET.unpack_from(data, offset)
+                offset += SNAPSHOT_BULLET.size
+                bullet = pool.acquire(x, fine_y // tick_rate,
+                                      BULLET_SIDES[side])
+                bullet.fine_y = fine_y
+                bullet.prev_y = prev_y
+
+        self.explosions.empty()
+        for _ in range(explosions):
+            self.explosions.add(*SNAPSHOT_EXPLOSION.unpack_from(data, offset))
+            offset += SNAPSHOT_EXPLOSION.size
+
+        for blocker in self.allBlockers:
+            size = (blocker.rect.width * blocker.rect.height + 7) // 8
+            blocker.set_pixels(data[offset:offset + size])
+            offset += size
+
+    def fork(self):
+        """A new, independent Simulation carrying on from this one's state."""
+        sim = Simulation(**self.rules)
+        # Copying the masks is quicker than unpacking the snapshot's bits;
+        # images are replaced rather than drawn on, so they can be shared
+        for blocker, source in zip(sim.allBlockers, self.allBlockers):
+            blocker.mask = source.mask.copy()
+            blocker.image = source.image
+        sim.restore(self.snapshot())
+        return sim
+
+    def step(self, controls=0):
+        """Advance the game by one tick using the INPUT_* bits in controls."""
+        self.tick += 1
+        del self.events[:]
+        if self.game_over:
+            return
+
+        current_time = self.now
+        if len(self.aliens) == 0:
+            if current_time - self.game_timer > 3000:
+                # Move enemies closer to bottom
+                self.alien_position_start += 35
+                self.reset(self.score, self.lives)
+                self.game_timer += 3000
+            return
+
+        mark = self.mark
+        mark('fire')
+        if controls & INPUT_FIRE:
+            self.fire()
+        mark('aliens')
+        self.aliens.update(current_time)
+        mark('sprites')
+        self.all_sprites.update(controls, current_time)
+        mark('bullets')
+        self.bullets.update()
+        self.alien_bullets.update()
+        if self.mystery_ship.entered:
+            self.mystery_ship.entered = False
+            self.events.append('mysteryentered')
+        mark('explosions')
+        self.explosions.update(current_time)
+        mark('collisions')
+        self.check_collisions()
+        mark('new_ship')
+        self.create_new_ship(self.make_new_ship, current_time)
+
+        mark('alien_shoot')
+        if len(self.aliens) > 0:
+            self.make_aliens_shoot()
+
     @staticmethod
     def make_bunkers(number):
-        bunker_group = sprite.Group()
-        for row in range(4):
-            for column in range(9):
-                bunker = Bunker(10, PINK, row, column)
-                bunker.rect.x = 50 + (200 * number) + (column * bunker.width)
-                bunker.rect.y = 450 + (row * bunker.height)
-                bunker_group.add(bunker)
-        return bunker_group
+        return Bunker(50 + (200 * number), 450, 90, 40, PINK)
+
+    def fire(self):
+        if len(self.bullets) >= self.bullet_limit or not self.ship_alive:
+            return
+        if self.fire_timer is not None and \
+                self.now - self.fire_timer < self.fire_interval:
+            return
+        self.fire_timer = self.now
+        x, y = self.player.rect.topleft
+        if self.dual_laser_score is None or self.score < self.dual_laser_score:
+            self.bullets.acquire(x + 23, y + 5, 'center')
+            self.events.append('shoot')
+        else:
+            self.bullets.acquire(x + 8, y + 5, 'left')
+            self.bullets.acquire(x + 38, y + 5, 'right')
+            self.events.append('shoot2')
+
+    def make_aliens(self):
+        self.aliens = AlienGroup(self.alien_columns, self.alien_rows, 157,
+                                 self.alien_position, self.now, self.random,
+                                 self.alien_scale)
+        self.all_sprites = sprite.Group(self.player, self.mystery_ship)
+
+    def make_aliens_shoot(self):
+        if (self.now - self.timer) > self.alien_fire_interval:
+            alien = self.aliens.random_bottom
+            if alien is not None:
+                # from (14, 20) on a stock 40x35 alien
+                aliens = self.aliens
+                self.alien_bullets.acquire(
+                    int(aliens.x[alien]) + aliens.width * 7 // 20,
+                    int(aliens.y[alien]) + aliens.height * 4 // 7)
+                self.timer = self.now
+
+    def calculate_score(self, row):
+        scores = {0: 30,
+                  1: 20,
+                  2: 20,
+                  3: 10,
+                  4: 10,
+                  5: self.random.choice([50, 100, 150, 300])
+                  }
+
+        score = scores[row]
+        self.score += score
+        return score
+
+    def pixels_touch(self, item, rect, image, other_rect):
+        """Narrow phase for two items whose rects overlap: whether any of
+        their opaque pixels meet."""
+        self.mask_tests += 1
+        return image_mask(item.image).overlap(
+            image_mask(image), (other_rect.x - rect.x,
+                                other_rect.y - rect.y)) is not None
+
+    def collide_aliens(self, item):
+        """Indices of the living aliens item touches, in row order."""
+        aliens = self.aliens
+        hits = aliens.collide_rect(item.rect)
+        if not self.pixel_collisions or not len(hits):
+            return hits
+        return [index for index in hits
+                if self.pixels_touch(item, item.rect, aliens.image(index),
+                                     aliens.rect(index))]
+
+    def check_collisions(self):
+        aliens = self.aliens
+        if self.bullets or self.alien_bullets:
+            self.check_bullet_collisions()
+
+        for playerShip in self.player_group:
+            if len(self.collide_aliens(playerShip)):
+                playerShip.kill()
+                self.game_over = True
+
+        for blocker in self.allBlockers:
+            for index in aliens.collide_rect(blocker.rect):
+                blocker.erase(aliens.rect(index))
+
+    def check_bullet_collisions(self):
+        grid = self.grid
+        grid.clear()
+        grid.add(self.alien_bullets, self.mystery_group, self.player_group)
+        # Each shot's neighbours are found once; the passes below pick out
+        # the group they care about and skip anything already removed
+        near = {bullet: grid.query(bullet.rect)
+                for group in (self.bullets, self.alien_bullets)
+                for bullet in group}
+
+        exact = self.pixel_collisions
+        pixels_touch = self.pixels_touch
+
+        def touching(bullet, group):
+            items = near[bullet]
+            if not items:
+                return items
+            rect = bullet.rect
+            return [item for item in items if group.has(item) and
+                    (not exact or
+                     pixels_touch(bullet, rect, item.image, item.rect))]
+
+        def touching_bunkers(bullet):
+            # bunkers test their own pixels as they are hit
+            return [item for item in near[bullet]
+                    if self.allBlockers.has(item)]
+
+        # Every pair is found before any shot is removed, so two shots
+        # hitting the same alien shot both count
+        bullet_hits = [(bullet, touching(bullet, self.alien_bullets))
+                       for bullet in self.bullets]
+        for bullet, targets in bullet_hits:
+            if targets:
+                bullet.kill()
+                for current_sprite in targets:
+                    current_sprite.kill()
+
+        aliens = self.aliens
+        alien_hits = [(bullet, self.collide_aliens(bullet))
+                      for bullet in self.bullets]
+        for bullet, hits in alien_hits:
+            if len(hits):
+                bullet.kill()
+                index = hits[0]
+                aliens.kill(index)
+                self.events.append('invaderkilled')
+                row = int(aliens.kind[index])
+                score = self.calculate_score(row)
+                self.explosions.add(aliens.x[index], aliens.y[index], row,
+                                    score, self.now)
+                self.game_timer = self.now
+
+        # The ship goes at its first hit, so a second shot over it flies on
+        # and the replacement cannot be hit on the same tick
+        mystery_hits = [(bullet, touching(bullet, self.mystery_group))
+                        for bullet in self.bullets]
+        for bullet, targets in mystery_hits:
+            for current_sprite in targets:
+                if not self.mystery_group.has(current_sprite):
+                    continue
+                bullet.kill()
+                self.events.append('mysterykilled')
+                score = self.calculate_score(current_sprite.row)
+                self.explosions.add(current_sprite.rect.x,
+                                    current_sprite.rect.y,
+                                    Explosions.MYSTERY, score, self.now)
+                current_sprite.kill()
+                new_ship = Mystery(self.now, self.tick_rate)
+                self.mystery_ship = new_ship
+                self.all_sprites.add(new_ship)
+                self.mystery_group.add(new_ship)
+                break
+
+        ship_hits = [(bullet, touching(bullet, self.player_group))
+                     for bullet in self.alien_bullets]
+        for bullet, targets in ship_hits:
+            for playerShip in targets:
+                bullet.kill()
+                if self.lives > 0:
+                    self.lives -= 1
+                else:
+                    self.game_over = True
+                self.events.append('shipexplosion')
+                self.explosions.add(playerShip.rect.x, playerShip.rect.y,
+                                    Explosions.SHIP, 0, self.now)
+                playerShip.kill()
+                self.make_new_ship = True
+                self.ship_timer = self.now
+                self.ship_alive = False
+
+        for group in (self.bullets, self.alien_bullets):
+            for bullet in group:
+                for blocker in touching_bunkers(bullet):
+                    if blocker.hit(bullet.rect, bullet.direction):
+                        bullet.kill()
+                        break
+
+    def create_new_ship(self, createShip, currentTime):
+        if createShip and (currentTime - self.ship_timer > 900):
+            self.player = Ship(self.tick_rate)
+            self.all_sprites.add(self.player)
+            self.player_group.add(self.player)
+            self.make_new_ship = False
+            self.ship_alive = True
+
+
+REPLAY_MAGIC = b'SIRP'
+# 2: shooters are picked from the living columns in swap-remove order
+# 3: the state hash always covers sub-pixel positions
+REPLAY_VERSION = 3
+# magic, version, seed, length of the rules JSON, ticks, state hash
+REPLAY_HEADER = struct.Struct('<4sBQHI32s')
+
+
+class Recording(object):
+    """A seed, the Simulation rules and one byte of controls per tick."""
+
+    def __init__(self, seed, rules=None, controls=b'', final_hash=None):
+        # refused now, as a snapshot would, rather than when it is saved
+        self.seed = check_seed(seed)
+        self.rules = rules or {}
+        self.controls = bytearray(controls)
+        self.final_hash = final_hash
+
+    def save(self, path):
+        rules = json.dumps(self.rules, sort_keys=True).encode()
+        with open(path, 'wb') as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION,
+                                       self.seed, len(rules),
+                                       len(self.controls),
+                                       bytes.fromhex(self.final_hash)))
+            f.write(rules)
+            f.write(zlib.compress(bytes(self.controls), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, seed, rules_length, ticks, final_hash = \
+            REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError('{} is not a version {} replay'.format(
+                path, REPLAY_VERSION))
+        start = REPLAY_HEADER.size
+        rules = json.loads(data[start:start + rules_length].decode())
+        controls = zlib.decompress(data[start + rules_length:])
+        if len(controls) != ticks:
+            raise ValueError('{} is truncated'.format(path))
+        return cls(seed, rules, controls, final_hash.hex())
+
+    def simulation(self):
+        """A new Simulation in the state this recording starts from."""
+        return Simulation(seed=self.seed, **self.rules)
+
+
+class Recorder(object):
+    """Collects the controls given to each step of one game."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        # the rules of the simulation itself, so the replay plays by them
+        self.recording = Recording(sim.seed, sim.rules)
+
+    def step(self, controls):
+        self.recording.controls.append(controls)
+        self.sim.step(controls)
+
+    def save(self, path):
+        self.recording.final_hash = self.sim.state_hash()
+        self.recording.save(path)
+
+
+BUNDLE_MAGIC = b'SIAB'
+BUNDLE_VERSION = 1
+# magic, version, length of the JSON index that follows
+BUNDLE_HEADER = struct.Struct('<4sBI')
+BUNDLE = None
+
+
+def get_bundle():
+    """The AssetBundle at BUNDLE_PATH, or None if none has been baked."""
+    global BUNDLE
+    if BUNDLE is None:
+        BUNDLE = AssetBundle(BUNDLE_PATH) if os.path.exists(BUNDLE_PATH) \
+            else False
+    return BUNDLE or None
+
+
+class AssetBundle(object):
+    """Every image and sound already decoded, in one memory-mapped file.
+
+    Images become surfaces over the mapped pixels and sounds are copied
+    straight into the mixer, so nothing is decompressed or resampled. Each
+    entry remembers the size and mtime of the file it came from and is
+    ignored once that file changes, so a stale bundle never hides an edited
+    asset.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # copy-on-write, so surfaces can share the mapped pixels
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, length = BUNDLE_HEADER.unpack_from(self.data)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError('{} is not a version {} asset bundle'.format(
+                path, BUNDLE_VERSION))
+        start = BUNDLE_HEADER.size
+        self.index = json.loads(self.data[start:start + length].decode())
+        self.base = start + length
+
+    def entry(self, kind, name, path):
+        """The index entry and bytes for name, or None if it is missing or
+        older than the file at path."""
+        entry = self.index[kind].get(name)
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry['source'] != [stat.st_size, stat.st_mtime_ns]:
+            return None
+        offset = self.base + entry['offset']
+        return entry, memoryview(self.data)[offset:offset + entry['length']]
+
+    def image(self, name, path):
+        found = self.entry('images', name, path)
+        if found is None:
+            return None
+        entry, pixels = found
+        return image.frombuffer(pixels, entry['size'], entry['format'])
+
+    def sound(self, name, path):
+        if self.index['mixer'] != list(mixer.get_init() or ()):
+            return None
+        found = self.entry('sounds', name, path)
+        if found is None:
+            return None
+        return mixer.Sound(buffer=found[1])
+
+    @staticmethod
+    def bake(path):
+        """Decode every image and sound and write them to path."""
+        if not mixer.get_init():
+            mixer.init(*MIXER_SETTINGS)
+        index = {'mixer': list(mixer.get_init()), 'images': {}, 'sounds': {}}
+        chunks = []
+        offset = 0
+
+        def add(kind, name, source, data, **fields):
+            nonlocal offset
+            stat = os.stat(source)
+            index[kind][name] = dict(fields, offset=offset, length=len(data),
+                                     source=[stat.st_size, stat.st_mtime_ns])
+            chunks.append(data)
+            offset += len(data)
+
+        for name, filename in IMAGE_FILES.items():
+            source = IMAGE_PATH + filename
+            surface = image.load(source)
+            if filename.endswith('.jpg'):
+                pixel_format = 'RGB'
+            else:
+                pixel_format = 'RGBA'
+                if surface.get_colorkey() is not None:
+                    # turn the colour key into transparent pixels
+                    rgba = Surface(surface.get_size(), SRCALPHA, 32)
+                    rgba.blit(surface, (0, 0))
+                    surface = rgba
+            add('images', name, source, image.tobytes(surface, pixel_format),
+                size=surface.get_size(), format=pixel_format)
+        for name in SOUND_NAMES:
+            source = SOUND_PATH + name + '.wav'
+            add('sounds', name, source, mixer.Sound(source).get_raw())
+
+        header = json.dumps(index, sort_keys=True).encode()
+        with open(path, 'wb') as f:
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION,
+                                       len(header)))
+            f.write(header)
+            for chunk in chunks:
+                f.write(chunk)
+
+
+class AssetLoader(threading.Thread):
+    """Decodes every image and sound the game uses.
+
+    start() does it on a background thread so a loading screen can be up
+    straight away; run() does it in place.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.total = len(IMAGE_FILES) + len(ATLAS_SIZES) + 1
+        self.done = 0
+        self.error = None
+
+    def run(self):
+        try:
+            for name in IMAGE_FILES:
+                IMAGES[name]
+                self.done += 1
+            for key in ATLAS_SIZES:
+                ATLAS[key]
+                self.done += 1
+            get_sound_bank()
+            self.done += 1
+        except Exception as error:
+            # re-raised on the main thread by SpaceInvaders.setup()
+            self.error = error
+
+
+# mixer channel group and priority of every sample in sounds/
+SOUND_NAMES = {'0': ('music', 0), '1': ('music', 0),
+               '2': ('music', 0), '3': ('music', 0),
+               'mysteryentered': ('mystery', 0),
+               'shoot': ('shots', 1), 'shoot2': ('shots', 1),
+               'invaderkilled': ('explosions', 1),
+               'mysterykilled': ('explosions', 2),
+               'shipexplosion': ('explosions', 3)}
+# channels reserved for each group
+CHANNEL_GROUPS = [('music', 1), ('mystery', 1), ('shots', 2),
+                  ('explosions', 3)]
+SOUND_BANK = None
+
+
+def load_sound(name):
+    """Decode a sample, from the asset bundle when it holds a current copy
+    in the mixer's format."""
+    path = SOUND_PATH + name + '.wav'
+    bundle = get_bundle()
+    sound = bundle.sound(name, path) if bundle else None
+    return sound if sound is not None else mixer.Sound(path)
+
+
+def get_sound_bank():
+    """The process-wide SoundBank, created on first use."""
+    global SOUND_BANK
+    if SOUND_BANK is None:
+        SOUND_BANK = SoundBank()
+    return SOUND_BANK
+
+
+class SoundBank(object):
+    """Every sample decoded once, played on reserved mixer channels.
+
+    Each group of sounds owns its own channels, so the march never loses
+    its channel to gunfire. When a group's channels are all busy, the
+    channel playing the least important sound is taken over, but only by a
+    sound of equal or higher priority.
+    """
+
+    def __init__(self):
+        self.loads = 0
+        self.sounds = {}
+        for name in SOUND_NAMES:
+            self.sounds[name] = load_sound(name)
+            self.loads += 1
+        total = sum(count for _, count in CHANNEL_GROUPS)
+        if mixer.get_num_channels() < total:
+            mixer.set_num_channels(total)
+        mixer.set_reserved(total)
+        self.channels = {}
+        first = 0
+        for group, count in CHANNEL_GROUPS:
+            self.channels[group] = [mixer.Channel(first + i)
+                                    for i in range(count)]
+            first += count
+        self.priorities = {group: [0] * len(channels)
+                           for group, channels in self.channels.items()}
+        # channel each sound last started on
+        self.playing = {}
+
+    def play(self, name):
+        """Start a sound; returns its channel, or None if it was dropped in
+        favour of more important sounds."""
+        group, priority = SOUND_NAMES[name]
+        channels = self.channels[group]
+        priorities = self.priorities[group]
+        index = None
+        for i, channel in enumerate(channels):
+            if not channel.get_busy():
+                index = i
+                break
+        else:
+            lowest = min(range(len(channels)), key=priorities.__getitem__)
+            if priorities[lowest] <= priority:
+                index = lowest
+        if index is None:
+            return None
+        channel = channels[index]
+        channel.play(self.sounds[name])
+        priorities[index] = priority
+        self.playing[name] = channel
+        return channel
+
+    def stop(self, name):
+        channel = self.playing.get(name)
+        if channel is not None and channel.get_sound() is self.sounds[name]:
+            channel.stop()
+
+    def fadeout(self, name, ms):
+        channel = self.playing.get(name)
+        if channel is not None and channel.get_sound() is self.sounds[name]:
+            channel.fadeout(ms)
+
+
+class Debris(object):
+    """Sparks thrown out by explosions, stored as arrays of positions,
+    velocities and lifetimes.
+
+    The sparks are only for show and live in the front end. follow() throws
+    a burst from each explosion the simulation added since it last looked,
+    using a generator of its own, so recorded games replay the same.
+    update() moves every spark in one vectorized step per tick.
+    draw_items() paints them all into one layer that reaches the screen as
+    a single blit, so thousands of sparks cost about as much as one sprite.
+    """
+    # columns of particles
+    X, Y, VX, VY, LIFE, SPAN = range(6)
+    # pixels per second per second, pulling the sparks down
+    GRAVITY = 240.0
+    # a spark is a square this many pixels across
+    SIZE = 2
+    # shades each colour fades through over a spark's life, brightest first
+    SHADES = 8
+    # colour, sparks, top speed in pixels per second and longest life in
+    # seconds of the burst from each kind of explosion
+    BURSTS = [(PURPLE, 24, 160, 0.6), (BLUE, 24, 160, 0.6),
+              (BLUE, 24, 160, 0.6), (GREEN, 24, 160, 0.6),
+              (GREEN, 24, 160, 0.6), (GREEN, 64, 200, 1.0),
+              (RED, 48, 240, 0.8)]
+    # where a burst starts, relative to the explosion's top left
+    CENTRES = [(20, 17)] * 5 + [(25, 24), (37, 17)]
+
+    def __init__(self, capacity=8192, seed=None):
+        # x, y, velocity, seconds left and seconds in all of each spark
+        self.particles = np.zeros((capacity, 6), np.float32)
+        # the explosion kind each spark came from, which sets its colour
+        self.kinds = np.zeros(capacity, np.uint8)
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+        # serial number of the first explosion not yet followed
+        self.followed = 0
+        self.layer = None
+        self.palette = None
+        # the part of the layer painted last time, cleared before the next
+        self.painted = None
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, y, kind, number, speed, life):
+        """Throw up to number sparks out from (x, y) in every direction;
+        any beyond the capacity are left out."""
+        start = self.count
+        number = min(number, len(self.particles) - start)
+        if number <= 0:
+            return
+        rng = self.rng
+        angles = rng.uniform(0.0, 2 * np.pi, number)
+        speeds = rng.uniform(0.2, 1.0, number) * speed
+        block = self.particles[start:start + number]
+        block[:, self.X] = x
+        block[:, self.Y] = y
+        block[:, self.VX] = np.cos(angles) * speeds
+        block[:, self.VY] = np.sin(angles) * speeds
+        block[:, self.LIFE] = block[:, self.SPAN] = \
+            rng.uniform(0.5, 1.0, number) * life
+        self.kinds[start:start + number] = kind
+        self.count += number
+
+    def follow(self, explosions):
+        """Throw a burst from each explosion added since the last call."""
+        count = explosions.count
+        new = np.flatnonzero(explosions.serial[:count] >= self.followed)
+        for x, y, kind in zip(explosions.x[new].tolist(),
+                              explosions.y[new].tolist(),
+                              explosions.kind[new].tolist()):
+            _, number, speed, life = self.BURSTS[kind]
+            dx, dy = self.CENTRES[kind]
+            self.spawn(x + dx, y + dy, kind, number, speed, life)
+        self.followed = explosions.added
+
+    def update(self, seconds):
+        """Move every spark on by seconds, and drop the ones that burned
+        out or left the screen."""
+        count = self.count
+        if not count:
+            return
+        particles = self.particles[:count]
+        particles[:, self.X:self.VX] += particles[:, self.VX:self.LIFE] * \
+            seconds
+        particles[:, self.VY] += self.GRAVITY * seconds
+        particles[:, self.LIFE] -= seconds
+        x = particles[:, self.X]
+        y = particles[:, self.Y]
+        width, height = SCREEN_SIZE
+        live = ((particles[:, self.LIFE] > 0) & (x >= 0) &
+                (x < width - self.SIZE) & (y >= 0) &
+                (y < height - self.SIZE))
+        if live.all():
+            return
+        kept = int(np.count_nonzero(live))
+        self.particles[:kept] = particles[live]
+        self.kinds[:kept] = self.kinds[:count][live]
+        self.count = kept
+
+    def create_layer(self):
+        # black is see-through, and no shade is dark enough to be black
+        self.layer = Surface(SCREEN_SIZE, 0, 32)
+        self.layer.set_colorkey((0, 0, 0))
+        fades = np.linspace(1.0, 0.25, self.SHADES)
+        self.palette = np.array(
+            [[self.layer.map_rgb([int(c * fade) for c in colour])
+              for fade in fades] for colour, _, _, _ in self.BURSTS],
+            np.uint32)
+
+    def draw_items(self):
+        """(key, image, position) of the layer holding every spark, or
+        nothing while there are none. The image is only valid until the
+        next call."""
+        if self.layer is None:
+            self.create_layer()
+        layer = self.layer
+        if self.painted:
+            layer.fill((0, 0, 0), self.painted)
+            self.painted = None
+        count = self.count
+        if not count:
+            return
+        particles = self.particles[:count]
+        x = particles[:, self.X].astype(np.intp)
+        y = particles[:, self.Y].astype(np.intp)
+        shades = ((1 - particles[:, self.LIFE] / particles[:, self.SPAN]) *
+                  self.SHADES).astype(np.intp)
+        np.clip(shades, 0, self.SHADES - 1, out=shades)
+        values = self.palette[self.kinds[:count], shades]
+        pixels = surfarray.pixels2d(layer)
+        for dx in range(self.SIZE):
+            for dy in range(self.SIZE):
+                pixels[x + dx, y + dy] = values
+        # the layer stays locked until the pixel array is gone
+        del pixels
+        left, top = int(x.min()), int(y.min())
+        self.painted = Rect(left, top, int(x.max()) + self.SIZE - left,
+                            int(y.max()) + self.SIZE - top)
+        yield self, layer.subsurface(self.painted), self.painted.topleft
+
+
+class StaticLayer(object):
+    """Content that rarely changes, composited over a background once.
+
+    draw(surface, state) paints the content for a state. update() only
+    rebuilds the composite when it is given a different state, so a frame
+    starts from a single blit of surface however much the layer holds.
+    """
+
+    def __init__(self, background, draw):
+        self.background = background
+        self.draw = draw
+        self.surface = background.copy()
+        self.state = None
+        self.rebuilds = 0
+
+    def invalidate(self):
+        """Rebuild on the next update whatever the state."""
+        self.state = None
+
+    def update(self, state):
+        """Bring the composite up to date; True if it had to be redrawn."""
+        if state is not None and state == self.state:
+            return False
+        self.state = state
+        self.surface.blit(self.background, (0, 0))
+        self.draw(self.surface, state)
+        self.rebuilds += 1
+        return True
+
+
+class DirtyRenderer(object):
+    """Redraws only what changed since the previous frame.
+
+    draw() takes (key, image, position) items in back-to-front order. Where
+    an item appeared, moved, changed image or went away, the background is
+    restored and every item overlapping that area is drawn again, clipped to
+    it. The returned rects are all that needs to reach the display.
+    """
+
+    def __init__(self, background):
+        self.background = background
+        self.previous = {}
+        self.full_redraw = True
+        self.frames = 0
+        self.changed_total = 0.0
+        self.changed_max = 0.0
+
+    def invalidate(self):
+        """Repaint the whole screen on the next draw."""
+        self.full_redraw = True
+
+    def draw(self, surface, items):
+        current = {}
+        for key, image, pos in items:
+            current[key] = image, Rect(pos, image.get_size())
+        screen_rect = surface.get_rect()
+
+        if self.full_redraw:
+            self.full_redraw = False
+            dirty = [screen_rect]
+        else:
+            dirty = []
+            previous = self.previous
+            for key, (image, rect) in previous.items():
+                now = current.get(key)
+                if now is None or now[0] is not image or now[1] != rect:
+                    dirty.append(rect)
+            for key, (image, rect) in current.items():
+                before = previous.get(key)
+                if before is None or before[0] is not image or \
+                        before[1] != rect:
+                    dirty.append(rect)
+
+        for area in dirty:
+            surface.set_clip(area)
+            surface.blit(self.background, area, area)
+            for image, rect in current.values():
+                if rect.colliderect(area):
+                    surface.blit(image, rect)
+        surface.set_clip(None)
+        self.previous = current
+
+        changed = sum(area.clip(screen_rect).width *
+                      area.clip(screen_rect).height for area in dirty)
+        fraction = min(1.0, changed / float(screen_rect.width *
+                                            screen_rect.height))
+        self.frames += 1
+        self.changed_total += fraction
+        self.changed_max = max(self.changed_max, fraction)
+        return dirty
+
+    def report(self):
+        if self.frames:
+            print('dirty rects: {:.1%} of pixels changed per frame on '
+                  'average, {:.1%} at most, over {} frames'.format(
+                      self.changed_total / self.frames, self.changed_max,
+                      self.frames))
+
+
+class Viewport(object):
+    """The logical screen's place in a window of another size, and the one
+    scale pass per frame that puts it there.
+
+    Frames are drawn at SCREEN_SIZE into screen and centred in the window,
+    keeping their aspect ratio. With smooth scaling they fill as much of
+    the window as fits, and each frame is filtered in whole. With integer
+    scaling every pixel becomes a zoom x zoom block, so only the rects
+    that changed need scaling. A window smaller than the logical screen
+    leaves no whole zoom, and the frame is then shrunk to fit.
+    """
+
+    def __init__(self, window, smooth):
+        self.window = window
+        self.screen = Surface(SCREEN_SIZE).convert()
+        self.smooth = smooth
+        width, height = SCREEN_SIZE
+        window_width, window_height = window.get_size()
+        zoom = min(window_width // width, window_height // height)
+        if smooth or not zoom:
+            self.zoom = None
+            fit = min(window_width / float(width),
+                      window_height / float(height))
+            size = (int(width * fit), int(height * fit))
+        else:
+            self.zoom = zoom
+            size = (width * zoom, height * zoom)
+        self.rect = Rect((0, 0), size)
+        self.rect.center = window.get_rect().center
+        self.target = window.subsurface(self.rect)
+
+    def scale(self, changed):
+        """Scale what changed on screen into the window: True for all of
+        it or a list of rects, as a scene's update() returns. Returns the
+        same for the window."""
+        if changed is True or self.zoom is None:
+            if self.smooth:
+                transform.smoothscale(self.screen, self.rect.size,
+                                      self.target)
+            else:
+                transform.scale(self.screen, self.rect.size, self.target)
+            return True if changed is True else [self.rect]
+        zoom = self.zoom
+        screen_rect = self.screen.get_rect()
+        scaled = []
+        for area in changed:
+            area = Rect(area).clip(screen_rect)
+            if not area:
+                continue
+            dest = Rect(area.x * zoom, area.y * zoom, area.width * zoom,
+                        area.height * zoom)
+            transform.scale(self.screen.subsurface(area), dest.size,
+                            self.target.subsurface(dest))
+            scaled.append(dest.move(self.rect.topleft))
+        return scaled
+
+
+class RenderThread(threading.Thread):
+    """Runs draw jobs one at a time on a second thread.
+
+    submit() hands a job over and returns straight away; wait() blocks
+    until it has finished and returns what it returned. In between, the
+    caller is free to run the next frame's ticks, as long as nothing the
+    job draws from is changed in place. pygame lets go of the GIL while it
+    blits, so the two overlap on a multi-core machine.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='render', daemon=True)
+        self.jobs = queue.Queue(1)
+        self.results = queue.Queue(1)
+        self.busy = False
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self.results.put((job(), None))
+            except Exception as e:
+                self.results.put((None, e))
+
+    def submit(self, job):
+        self.busy = True
+        self.jobs.put(job)
+
+    def wait(self):
+        """The result of the job in flight, or False if there is none."""
+        if not self.busy:
+            return False
+        self.busy = False
+        result, error = self.results.get()
+        if error is not None:
+            raise error
+        return result
+
+
+class AllocationCounter(object):
+    """Memory allocated per frame, averaged per scene.
+
+    Uses tracemalloc, which slows everything down, so it is only switched on
+    with --count-allocations. "KiB" is the peak allocated during the frame
+    above its starting point; "blocks" is the net change in live blocks.
+    """
+
+    def __init__(self):
+        tracemalloc.start()
+        self.frames = defaultdict(int)
+        self.allocated = defaultdict(int)
+        self.blocks = defaultdict(int)
+        self.start_memory = 0
+        self.start_blocks = 0
+
+    def start_frame(self):
+        tracemalloc.reset_peak()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_blocks = sys.getallocatedblocks()
+
+    def end_frame(self, scene):
+        peak = tracemalloc.get_traced_memory()[1]
+        self.frames[scene] += 1
+        self.allocated[scene] += peak - self.start_memory
+        self.blocks[scene] += sys.getallocatedblocks() - self.start_blocks
+
+    def report(self):
+        for scene, frames in sorted(self.frames.items()):
+            print('{:<12}{:>8} frames {:10.1f} KiB/frame {:8.1f} '
+                  'blocks/frame'.format(
+                      scene, frames, self.allocated[scene] / 1024.0 / frames,
+                      self.blocks[scene] / float(frames)))
+
+
+class InputLatency(object):
+    """How long a fire press takes to reach the screen.
+
+    Each press is stamped when it arrives, followed to the tick that fires
+    a shot for it and then to the display update that first shows that
+    tick. The two stretches and their sum are gathered into histograms,
+    reported on exit. Presses that fire nothing, because the shot limit
+    was reached, are only counted.
+    """
+    # histogram buckets in ms; the last one holds everything slower
+    BUCKET_MS = 4
+    BUCKETS = 12
+    STRETCHES = ['input to tick', 'tick to display', 'input to display']
+
+    def __init__(self):
+        # arrival times of presses not yet simulated
+        self.pressed = []
+        # (arrival, tick time) of shots fired but not yet drawn, and of
+        # those drawn but not yet presented
+        self.fired = []
+        self.drawn = []
+        self.samples = {stretch: [] for stretch in self.STRETCHES}
+        self.missed = 0
+
+    def press(self, arrival):
+        self.pressed.append(arrival)
+
+    def tick(self, fired):
+        """After the tick that was given the waiting presses; fired when it
+        put a shot on screen for them."""
+        if not self.pressed:
+            return
+        if fired:
+            ticked = perf_counter()
+            self.fired += [(arrival, ticked) for arrival in self.pressed]
+        else:
+            self.missed += len(self.pressed)
+        del self.pressed[:]
+
+    def draw(self):
+        """A frame was drawn, or handed to the render thread, showing every
+        shot fired so far."""
+        self.drawn += self.fired
+        del self.fired[:]
+
+    def present(self):
+        """That frame reached the display."""
+        if not self.drawn:
+            return
+        shown = perf_counter()
+        for arrival, ticked in self.drawn:
+            self.samples['input to tick'].append(ticked - arrival)
+            self.samples['tick to display'].append(shown - ticked)
+            self.samples['input to display'].append(shown - arrival)
+        del self.drawn[:]
+
+    def report(self):
+        presses = len(self.samples['input to display'])
+        print('input latency: {} presses shown, {} fired no shot'.format(
+            presses, self.missed))
+        if not presses:
+            return
+        print('{:<18}{:>8}{:>8}{:>8}{:>8}'.format('ms', 'p50', 'p95', 'p99',
+                                                  'max'))
+        for stretch in self.STRETCHES:
+            ordered = sorted(self.samples[stretch])
+            print('{:<18}{:8.1f}{:8.1f}{:8.1f}{:8.1f}'.format(
+                stretch, *(ordered[min(presses - 1, int(fraction * presses))]
+                           * 1000 for fraction in (0.5, 0.95, 0.99, 1.0))))
+        counts = {stretch: [0] * self.BUCKETS for stretch in self.STRETCHES}
+        for stretch, samples in self.samples.items():
+            for seconds in samples:
+                bucket = int(seconds * 1000 // self.BUCKET_MS)
+                counts[stretch][min(bucket, self.BUCKETS - 1)] += 1
+        print('{:<18}'.format('histogram') +
+              ''.join('{:>18}'.format(stretch) for stretch in self.STRETCHES))
+        for bucket in range(self.BUCKETS):
+            low = bucket * self.BUCKET_MS
+            if bucket == self.BUCKETS - 1:
+                label = '{} ms+'.format(low)
+            else:
+                label = '{}-{} ms'.format(low, low + self.BUCKET_MS)
+            print('{:<18}'.format(label) + ''.join(
+                '{:>18}'.format(counts[stretch][bucket])
+                for stretch in self.STRETCHES))
+
+
+class FrameProfiler(object):
+    """Wall time spent in each phase of a frame.
+
+    Code calls mark() where a phase starts; the phase runs until the next
+    mark or the end of the frame, and anything before the first mark is
+    counted as "update". Recent frames scroll past as a stacked bar graph,
+    and with a trace path every profiled frame is saved on exit as a
+    Chrome trace (load it in chrome://tracing or Perfetto).
+    """
+    PHASES = ['update', 'music', 'input', 'fire', 'aliens', 'sprites',
+              'bullets', 'explosions', 'collisions', 'new_ship',
+              'alien_shoot', 'debris', 'sounds', 'wait', 'draw', 'overlay',
+              'present']
+    # one 2px bar per frame, scaled so the budget for a frame at FRAME_RATE
+    # is half the height
+    GRAPH_SIZE = (240, 192)
+    LEGEND_WIDTH = 120
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.trace = []
+        self.frames = 0
+        self.totals = defaultdict(float)
+        self.worst = defaultdict(float)
+        self.origin = perf_counter()
+        self.scene = None
+        self.frame = []
+        self.last_frame = []
+        self.frame_start = 0
+        self.phase = None
+        self.phase_start = 0
+        self.colours = {}
+        for index, phase in enumerate(self.PHASES):
+            colour = Color(0)
+            colour.hsva = (index * 360.0 / len(self.PHASES), 70, 100, 100)
+            self.colours[phase] = tuple(colour)
+        width, height = self.GRAPH_SIZE
+        self.panel = Surface((width + self.LEGEND_WIDTH, height))
+        self.rect = self.panel.get_rect(topleft=(5, 35))
+        for index, phase in enumerate(self.PHASES):
+            self.panel.blit(render_text(FONT, 12, phase, self.colours[phase]),
+                            (width + 6, 12 * index))
+        self.graph = self.panel.subsurface((0, 0, width, height))
+
+    def start_frame(self, scene):
+        self.scene = scene
+        self.frame = []
+        self.frame_start = perf_counter()
+        self.phase = 'update'
+        self.phase_start = self.frame_start
+
+    def mark(self, phase):
+        now = perf_counter()
+        if self.phase is not None:
+            self.frame.append((self.phase, self.phase_start,
+                               now - self.phase_start))
+        self.phase = phase
+        self.phase_start = now
+
+    def end_frame(self):
+        self.mark(None)
+        frame = self.last_frame = self.frame
+        self.frames += 1
+        for phase, _, duration in frame:
+            self.totals[phase] += duration
+            if duration > self.worst[phase]:
+                self.worst[phase] = duration
+        if self.trace_path:
+            self.trace.append((self.scene, self.frame_start,
+                               self.phase_start - self.frame_start, frame))
+
+    def draw(self, surface):
+        """Add the last finished frame to the graph and draw it onto
+        surface; returns the rect it covers."""
+        graph = self.graph
+        width, height = self.GRAPH_SIZE
+        graph.scroll(-2, 0)
+        graph.fill((0, 0, 0), (width - 2, 0, 2, height))
+        scale = height / 2.0 * FRAME_RATE
+        y = height
+        for phase, _, duration in self.last_frame:
+            bar = int(duration * scale + 0.5)
+            if bar:
+                y -= bar
+                graph.fill(self.colours[phase], (width - 2, y, 2, bar))
+        graph.fill(WHITE, (width - 2, height // 2, 2, 1))
+        surface.blit(self.panel, self.rect)
+        return self.rect
+
+    def save_trace(self):
+        """Write the profiled frames as Chrome trace events."""
+        events = []
+        for scene, start, duration, frame in self.trace:
+            events.append({'name': scene, 'cat': 'frame', 'ph': 'X',
+                           'pid': 1, 'tid': 1,
+                           'ts': (start - self.origin) * 1e6,
+                           'dur': duration * 1e6})
+            for phase, phase_start, phase_duration in frame:
+                events.append({'name': phase, 'cat': 'phase', 'ph': 'X',
+                               'pid': 1, 'tid': 1,
+                               'ts': (phase_start - self.origin) * 1e6,
+                               'dur': phase_duration * 1e6})
+        with open(self.trace_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def report(self):
+        if not self.frames:
+            return
+        for phase in self.PHASES:
+            if phase in self.totals:
+                print('{:<12}{:8.3f} ms/frame {:8.3f} ms worst'.format(
+                    phase, self.totals[phase] * 1000 / self.frames,
+                    self.worst[phase] * 1000))
+        if self.trace_path:
+            self.save_trace()
+
+
+class Scene(object):
+    """One state of the front end.
+
+    enter() and exit() run once per transition, so expensive setup belongs
+    there. tick() runs once per simulation tick, however many are due in a
+    frame. update() runs every frame and returns what has to be pushed to
+    the display: True for the whole screen, a list of rects for part of
+    it, or False for nothing.
+    """
+    name = None
+
+    def __init__(self, game):
+        self.game = game
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def tick(self):
+        pass
+
+    def update(self):
+        return False
+
+    def render_list(self):
+        """What update() would draw, captured so that it can be drawn on
+        the render thread; None if the scene can only update()."""
+        return None
+
+
+class LoadingScene(Scene):
+    """A progress bar shown while the assets load in the background."""
+    name = 'loading'
+
+    def __init__(self, game):
+        Scene.__init__(self, game)
+        self.bar = Rect(200, 330, 400, 10)
+        self.redraw = False
+
+    def enter(self):
+        screen = self.game.screen
+        screen.fill((0, 0, 0))
+        Text(FONT, 25, 'Loading', WHITE, 345, 285).draw(screen)
+        draw.rect(screen, WHITE, self.bar.inflate(6, 6), 1)
+        self.redraw = True
+
+    def update(self):
+        game = self.game
+        for _, e in game.get_events():
+            if game.should_exit(e):
+                sys.exit()
+        loader = game.loader
+        if not loader.is_alive():
+            game.setup()
+            game.start()
+            return False
+        bar = self.bar
+        game.screen.fill(WHITE, (bar.x, bar.y,
+                                 bar.width * loader.done // loader.total,
+                                 bar.height))
+        if self.redraw:
+            self.redraw = False
+            return True
+        return [bar]
+
+
+class TitleScene(Scene):
+    name = 'title'
+
+    def __init__(self, game):
+        Scene.__init__(self, game)
+        self.surface = None
+        self.redraw = False
+
+    def enter(self):
+        # The title never changes, so it is rendered once and reused
+        if self.surface is None:
+            self.surface = self.game.create_main_menu()
+        self.redraw = True
+
+    def update(self):
+        for _, e in self.game.get_events():
+            if self.game.should_exit(e):
+                sys.exit()
+            if e.type == KEYUP:
+                self.game.new_game()
+                return False
+
+        if self.redraw:
+            self.game.screen.blit(self.surface, (0, 0))
+            self.redraw = False
+            return True
+        return False
+
+
+class PlayScene(Scene):
+    name = 'playing'
+
+    def enter(self):
+        self.game.note_timer = self.game.sim.now
+        self.game.note_index = 0
+
+    def tick(self):
+        game = self.game
+        game.mark('music')
+        game.play_main_music(game.sim.now)
+        game.step()
+        game.mark('sounds')
+        game.play_sounds()
+        if game.sim.game_over:
+            game.change_scene('game_over')
+        elif game.sim.round_over:
+            game.change_scene('round')
+
+    def update(self):
+        self.game.mark('draw')
+        return self.game.draw_game()
+
+    def render_list(self):
+        return self.game.render_list()
+
+
+class RoundScene(Scene):
+    name = 'round'
+
+    def tick(self):
+        game = self.game
+        game.step()
+        if not game.sim.round_over:
+            game.change_scene('playing')
+
+    def update(self):
+        self.game.mark('draw')
+        return self.game.draw_game()
+
+    def render_list(self):
+        return self.game.render_list()
+
+
+class GameOverScene(Scene):
+    name = 'game_over'
+
+    def enter(self):
+        self.game.timer = time.get_ticks()
+        self.game.end_game()
+
+    def update(self):
+        self.game.create_game_over(time.get_ticks())
+        return True
+
+
+class SpaceInvaders(object):
+    def __init__(self, count_allocations=False, dirty_rects=False,
+                 rules=None, record=None, replay=None, player=None,
+                 profile=False, profile_trace=None, load_in_background=False,
+                 frame_rate=FRAME_RATE, vsync=False, threaded=False,
+                 debris=False, window_size=SCREEN_SIZE, fullscreen=False,
+                 smooth_scaling=True, input_latency=False,
+                 low_latency=False):
+        mixer.pre_init(*MIXER_SETTINGS)
+        init()
+        event.set_blocked(None)
+        event.set_allowed(GAME_EVENTS + EXPOSE_EVENTS)
+        self.caption = display.set_caption('Space Invaders')
+        self.window = self.open_window(vsync, window_size, fullscreen)
+        # everything is drawn to screen at the logical size; in a window of
+        # any other size, the viewport scales each frame into it
+        self.viewport = None
+        if self.window.get_size() == SCREEN_SIZE:
+            self.screen = self.window
+        else:
+            self.viewport = Viewport(self.window, smooth_scaling)
+            self.screen = self.viewport.screen
+        self.clock = time.Clock()
+        # frames drawn per second at most, 0 for no cap
+        self.frame_rate = frame_rate
+        # wall time not yet simulated, and how far the frame being drawn is
+        # between the previous tick and the latest one (0 to 1)
+        self.lag = 0.0
+        self.alpha = 1.0
+        self.last_frame = None
+        # events taken off the queue while waiting for the next frame, with
+        # the time each arrived, and when that wait last ended
+        self.arrived = []
+        self.wait_end = None
+        # whether a key press cuts the wait short at the next tick
+        self.low_latency = low_latency
+        self.latency = InputLatency() if input_latency else None
+        # keyword arguments for Simulation, e.g. a harder bullet_limit
+        self.rules = rules or {}
+        # path each game is recorded to, and the Recording being played back
+        self.record_path = record
+        self.recorder = None
+        self.replay = replay
+        self.replay_tick = 0
+        # Simulation.snapshot() taken by the quick save key
+        self.quick_save = None
+        # scripted stand-in for the keyboard: called with the Simulation,
+        # returns its INPUT_* bits
+        self.player = player
+        # sparks thrown out by explosions, moved once per tick
+        self.debris = Debris() if debris else None
+        self.scenes = {scene.name: scene(self) for scene in
+                       (LoadingScene, TitleScene, PlayScene, RoundScene,
+                        GameOverScene)}
+        self.scene = None
+        self.allocations = AllocationCounter() if count_allocations else None
+        self.dirty_rects = dirty_rects
+        self.renderer = None
+        # whether the next present has to cover the whole window
+        self.exposed = False
+        self.profile = profile or profile_trace is not None
+        self.profile_trace = profile_trace
+        self.profiler = None
+        self.mark = no_mark
+        # draws each play frame while the next one's ticks run, presenting
+        # it a frame later
+        self.render_thread = None
+        if threaded:
+            self.render_thread = RenderThread()
+            self.render_thread.start()
+        self.ready = False
+        self.loader = AssetLoader()
+        if load_in_background:
+            self.loader.start()
+        else:
+            self.loader.run()
+            self.setup()
+
+    @staticmethod
+    def open_window(vsync, size=SCREEN_SIZE, fullscreen=False):
+        flags = FULLSCREEN if fullscreen else 0
+        if vsync:
+            # SDL only syncs accelerated windows, so ask for a scaled one;
+            # SDL then also scales it to fill the display when fullscreen
+            try:
+                return display.set_mode(size, flags | SCALED, vsync=1)
+            except error:
+                print('vsync is not available, using the frame cap instead')
+        if fullscreen:
+            # at the desktop's resolution
+            size = (0, 0)
+        return display.set_mode(size, flags)
+
+    def setup(self):
+        """Build everything that needs the assets, once they are loaded."""
+        if self.loader.error:
+            raise self.loader.error
+        self.background = IMAGES['background']
+        self.sim = self.replay.simulation() if self.replay \
+            else Simulation(**self.rules)
+        self.timer = time.get_ticks()
+        self.reset_lives(self.sim.lives)
+        self.create_audio()
+        self.create_text()
+        self.play_layer = StaticLayer(self.background, self.draw_hud)
+        self.game_over_layer = StaticLayer(self.background,
+                                           self.draw_game_over_text)
+        if self.dirty_rects:
+            self.renderer = DirtyRenderer(self.play_layer.surface)
+        if self.profile:
+            self.toggle_profiler()
+        self.ready = True
+
+    def start(self):
+        """Show the title screen, or go straight into a replay."""
+        self.change_scene('playing' if self.replay else 'title')
+
+    def new_game(self):
+        self.reset(0, 3, True)
+        if self.record_path:
+            self.recorder = Recorder(self.sim)
+        if self.renderer:
+            self.renderer.invalidate()
+        self.change_scene('playing')
+
+    def end_game(self):
+        if self.recorder:
+            self.recorder.save(self.record_path)
+            self.recorder = None
+        if self.replay:
+            self.finish_replay()
+
+    def finish_replay(self):
+        matched = self.sim.state_hash() == self.replay.final_hash
+        print('replay of {} ticks finished, {}'.format(
+            self.replay_tick,
+            'state hash matches' if matched else 'STATE HASH MISMATCH'))
+        sys.exit(0 if matched else 1)
+
+    def toggle_profiler(self):
+        """Switch the frame profiler and its overlay on or off."""
+        if self.mark is no_mark:
+            if self.profiler is None:
+                self.profiler = FrameProfiler(self.profile_trace)
+            self.mark = self.profiler.mark
+        else:
+            self.mark = no_mark
+            if self.renderer:
+                self.renderer.invalidate()
+        self.sim.mark = self.mark
+
+    def step(self):
+        """Advance the simulation one tick with this frame's input, or the
+        recorded input when replaying."""
+        self.mark('input')
+        controls = self.check_input()
+        if self.player:
+            controls = self.player(self.sim)
+        if self.replay:
+            if self.replay_tick == len(self.replay.controls):
+                self.finish_replay()
+            controls = self.replay.controls[self.replay_tick]
+            self.replay_tick += 1
+        if self.recorder:
+            self.recorder.step(controls)
+        else:
+            self.sim.step(controls)
+        if self.latency:
+            events = self.sim.events
+            self.latency.tick('shoot' in events or 'shoot2' in events)
+        if self.debris is not None:
+            self.mark('debris')
+            self.debris.follow(self.sim.explosions)
+            self.debris.update(1.0 / self.sim.tick_rate)
+
+    def report(self):
+        if self.recorder:
+            self.recorder.save(self.record_path)
+            self.recorder = None
+        if self.profiler:
+            self.profiler.report()
+        if self.allocations:
+            self.allocations.report()
+        if self.renderer:
+            self.renderer.report()
+        if self.latency:
+            self.latency.report()
+        if self.ready and self.sim.pixel_collisions:
+            print('pixel collisions: {} mask tests in {} ticks'.format(
+                self.sim.mask_tests, self.sim.tick))
+
+    def change_scene(self, name):
+        if self.scene is not None:
+            self.scene.exit()
+        self.scene = self.scenes[name]
+        self.scene.enter()
+
+    def reset(self, score, lives, new_game=False):
+        self.sim.reset(score, lives, new_game)
+        self.reset_lives(lives)
 
     def reset_lives_sprites(self):
         self.life1 = Life(715, 3)
@@ -381,28 +2738,28 @@ class SpaceInvaders(object):
             self.lives_group = sprite.Group(self.life1, self.life2)
         elif self.lives == 1:
             self.lives_group = sprite.Group(self.life1)
+        else:
+            self.lives_group = sprite.Group()
 
     def reset_lives(self, lives):
         self.lives = lives
         self.reset_lives_sprites()
 
     def create_audio(self):
-        self.sounds = {}
-        for sound_name in ['shoot', 'shoot2', 'invaderkilled', 'mysterykilled',
-                           'shipexplosion']:
-            self.sounds[sound_name] = mixer.Sound(
-                SOUND_PATH + '{}.wav'.format(sound_name))
-            # self.sounds[sound_name].set_volume(0.2)
-
-        self.music_notes = [mixer.Sound(SOUND_PATH + '{}.wav'.format(i)) for i
-                            in range(4)]
-        # for sound in self.musicNotes:
-        #     sound.set_volume(0.5)
-
+        self.sounds = get_sound_bank()
+        self.music_notes = [str(i) for i in range(4)]
         self.note_index = 0
 
+    def play_sounds(self):
+        for name in self.sim.events:
+            if name == 'mysterykilled':
+                self.sounds.stop('mysteryentered')
+            self.sounds.play(name)
+            if name == 'mysteryentered':
+                self.sounds.fadeout(name, 4000)
+
     def play_main_music(self, current_time):
-        move_time = self.aliens.sprites()[0].move_time
+        move_time = self.sim.aliens.move_time
         if current_time - self.note_timer > move_time:
             self.note = self.music_notes[self.note_index]
             if self.note_index < 3:
@@ -410,7 +2767,7 @@ class SpaceInvaders(object):
             else:
                 self.note_index = 0
 
-            self.note.play()
+            self.sounds.play(self.note)
             self.note_timer += move_time
 
     def create_text(self):
@@ -424,6 +2781,7 @@ class SpaceInvaders(object):
         self.alien3_text = Text(FONT, 25, '   =  30 pts', PURPLE, 368, 370)
         self.alien4_text = Text(FONT, 25, '   =  ?????', RED, 368, 420)
         self.score_text = Text(FONT, 20, 'Score', WHITE, 5, 5)
+        self.scoreText2 = NumberText(FONT, 20, GREEN, 85, 5)
         self.lives_text = Text(FONT, 20, 'Lives ', WHITE, 640, 5)
 
     @staticmethod
@@ -432,269 +2790,382 @@ class SpaceInvaders(object):
         return evt.type == QUIT or (evt.type == KEYUP and evt.key == K_ESCAPE)
 
     def check_input(self):
-        self.keys = key.get_pressed()
-        for e in event.get():
+        """Collect this frame's keyboard state as Simulation INPUT_* bits."""
+        keys = key.get_pressed()
+        controls = 0
+        if keys[K_LEFT]:
+            controls |= INPUT_LEFT
+        if keys[K_RIGHT]:
+            controls |= INPUT_RIGHT
+        for arrival, e in self.get_events():
             if self.should_exit(e):
                 sys.exit()
-            if e.type == KEYDOWN:
-                if e.key == K_SPACE:
-                    if len(self.bullets) <= 3 and self.ship_alive:
-                        # this allows us to set a score limit to when we can have dual lasers
-                        # like galaga
-                        # if self.score < 1000:
-                        bullet = Bullet(self.player.rect.x + 23,
-                                        self.player.rect.y + 5, -1,
-                                        15, 'laser', 'center')
-                        self.bullets.add(bullet)
-                        self.all_sprites.add(self.bullets)
-                        self.sounds['shoot'].play()
-                    # Code below enables dual lasers
-                    # else:
-                    #     leftbullet = Bullet(self.player.rect.x + 8,
-                    #                         self.player.rect.y + 5, -1,
-                    #                         15, 'laser', 'left')
-                    #     rightbullet = Bullet(self.player.rect.x + 38,
-                    #                          self.player.rect.y + 5, -1,
-                    #                          15, 'laser', 'right')
-                    #     self.bullets.add(leftbullet)
-                    #     self.bullets.add(rightbullet)
-                    #     self.allSprites.add(self.bullets)
-                    #     self.sounds['shoot2'].play()
-
-    def make_aliens(self):
-        aliens = AlienGroup(10, 5)
-        for row in range(5):
-            for column in range(10):
-                alien = Aliens(row, column)
-                alien.rect.x = 157 + (column * 50)
-                alien.rect.y = self.alien_position + (row * 45)
-                aliens.add(alien)
-
-        self.aliens = aliens
-        self.all_sprites = sprite.Group(self.player, self.aliens,
-                                        self.lives_group, self.mystery_ship)
-
-    def make_aliens_shoot(self):
-        if (time.get_ticks() - self.timer) > 700:
-            alien = self.aliens.random_bottom
-            if alien:
-                self.alien_bullets.add(
-                    Bullet(alien.rect.x + 14, alien.rect.y + 20, 1, 5,
-                           'alienlaser', 'center'))
-                self.all_sprites.add(self.alien_bullets)
-                self.timer = time.get_ticks()
-
-    def calculate_score(self, row):
-        scores = {0: 30,
-                  1: 20,
-                  2: 20,
-                  3: 10,
-                  4: 10,
-                  5: choice([50, 100, 150, 300])
-                  }
-
-        score = scores[row]
-        self.score += score
-        return score
+            if e.type == KEYDOWN and e.key == K_SPACE:
+                controls |= INPUT_FIRE
+                if self.latency:
+                    self.latency.press(arrival)
+            if e.type == KEYDOWN and e.key == K_F3:
+                self.toggle_profiler()
+            if e.type == KEYDOWN and e.key == K_F5:
+                self.quick_save = self.sim.snapshot()
+            if e.type == KEYDOWN and e.key == K_F9:
+                self.quick_load()
+        return controls
+
+    def quick_load(self):
+        """Go back to the quick save. Not while recording or replaying,
+        where it would break the recorded game."""
+        if self.quick_save is None or self.recorder or self.replay:
+            return
+        self.sim.restore(self.quick_save)
+        self.sounds.stop('mysteryentered')
+        self.note_timer = self.sim.now
 
     def create_main_menu(self):
-        self.alien1 = IMAGES['alien3_1']
-        self.alien1 = transform.scale(self.alien1, (40, 40))
-        self.alien2 = IMAGES['alien2_2']
-        self.alien2 = transform.scale(self.alien2, (40, 40))
-        self.alien3 = IMAGES['alien1_2']
-        self.alien3 = transform.scale(self.alien3, (40, 40))
-        self.mystery = IMAGES['mystery']
-        self.mystery = transform.scale(self.mystery, (80, 40))
-        self.screen.blit(self.alien1, (318, 270))
-        self.screen.blit(self.alien2, (318, 320))
-        self.screen.blit(self.alien3, (318, 370))
-        self.screen.blit(self.mystery, (299, 420))
-
-        for e in event.get():
-            if self.should_exit(e):
-                sys.exit()
-            if e.type == KEYUP:
-                self.start_game = True
-                self.main_screen = False
-
-    def update_alien_speed(self):
-        if len(self.aliens) <= 10:
-            for alien in self.aliens:
-                alien.move_time = 400
-        if len(self.aliens) == 1:
-            for alien in self.aliens:
-                alien.move_time = 200
+        """Render the title screen into a new surface."""
+        surface = self.background.copy()
+        self.title_text.draw(surface)
+        self.title_text2.draw(surface)
+        self.alien1_text.draw(surface)
+        self.alien2_text.draw(surface)
+        self.alien3_text.draw(surface)
+        self.alien4_text.draw(surface)
+        surface.blit(ATLAS['alien3_1', (40, 40)], (318, 270))
+        surface.blit(ATLAS['alien2_2', (40, 40)], (318, 320))
+        surface.blit(ATLAS['alien1_2', (40, 40)], (318, 370))
+        surface.blit(ATLAS['mystery', (80, 40)], (299, 420))
+        return surface
+
+    def render_items(self):
+        """Everything drawn during play as (key, image, position), back to
+        front. The key identifies the item from one frame to the next."""
+        sim = self.sim
+        for index, (glyph, pos) in enumerate(self.scoreText2.blit_list):
+            yield (self.scoreText2, index), glyph, pos
+        if sim.round_over:
+            return
+
+        for item in sim.allBlockers:
+            yield item, item.image, item.rect.topleft
+        for index, image, pos in sim.aliens.draw_items():
+            yield (sim.aliens, index), image, pos
+        alpha = self.alpha
+        for item in sim.all_sprites:
+            yield item, item.image, item.draw_position(alpha)
+        for pool in (sim.bullets, sim.alien_bullets):
+            for item in pool.draw_items(alpha):
+                yield item
+        for serial, image, pos in sim.explosions.draw_items(sim.now):
+            yield (sim.explosions, serial), image, pos
+        if self.debris is not None:
+            for item in self.debris.draw_items():
+                yield item
+
+    def draw_hud(self, surface, state):
+        """The play screen's static layer: labels, lives and, between
+        rounds, the next round banner. state is (lives icons, round over);
+        the icons are replaced rather than changed, so a group is only ever
+        drawn one way."""
+        lives_group, round_over = state
+        self.score_text.draw(surface)
+        self.lives_text.draw(surface)
+        lives_group.draw(surface)
+        if round_over:
+            self.next_round_text.draw(surface)
+
+    def render_list(self):
+        """The play screen as it stands: the static layer's state and a
+        tuple of render items. Nothing in it changes afterwards, so it can
+        be drawn while the simulation moves on."""
+        sim = self.sim
+        if self.lives != sim.lives:
+            self.reset_lives(sim.lives)
+        self.scoreText2.set_value(sim.score)
+        return (self.lives_group, sim.round_over), tuple(self.render_items())
+
+    def draw_render_list(self, render_list):
+        layer_state, items = render_list
+        if self.play_layer.update(layer_state) and self.renderer:
+            self.renderer.invalidate()
+        if self.renderer:
+            return self.renderer.draw(self.screen, items)
+
+        self.screen.blit(self.play_layer.surface, (0, 0))
+        self.screen.blits([(image, pos) for _, image, pos in items], False)
+        return True
 
-    def check_collisions(self):
-        collide_dict = sprite.groupcollide(self.bullets, self.alien_bullets,
-                                          True, False)
-        if collide_dict:
-            for value in collide_dict.values():
-                for current_sprite in value:
-                    self.alien_bullets.remove(current_sprite)
-                    self.all_sprites.remove(current_sprite)
-
-        alien_dict = sprite.groupcollide(self.bullets, self.aliens,
-                                         True, False)
-        if alien_dict:
-            for value in alien_dict.values():
-                for current_sprite in value:
-                    self.aliens.kill(current_sprite)
-                    self.sounds['invaderkilled'].play()
-                    score = self.calculate_score(current_sprite.row)
-                    explosion = Explosion(current_sprite.rect.x, current_sprite.rect.y,
-                                          current_sprite.row, False, False, score)
-                    self.explosions_group.add(explosion)
-                    self.all_sprites.remove(current_sprite)
-                    self.aliens.remove(current_sprite)
-                    self.game_timer = time.get_ticks()
-                    break
-
-        mystery_dict = sprite.groupcollide(self.bullets, self.mystery_group,
-                                          True, True)
-        if mystery_dict:
-            for value in mystery_dict.values():
-                for current_sprite in value:
-                    current_sprite.mysteryEntered.stop()
-                    self.sounds['mysterykilled'].play()
-                    score = self.calculate_score(current_sprite.row)
-                    explosion = Explosion(current_sprite.rect.x, current_sprite.rect.y,
-                                          current_sprite.row, False, True, score)
-                    self.explosions_group.add(explosion)
-                    self.all_sprites.remove(current_sprite)
-                    self.mystery_group.remove(current_sprite)
-                    new_ship = Mystery()
-                    self.all_sprites.add(new_ship)
-                    self.mystery_group.add(new_ship)
-                    break
-
-        bullets_dict = sprite.groupcollide(self.alien_bullets, self.player_group,
-                                          True, False)
-        if bullets_dict:
-            for value in bullets_dict.values():
-                for playerShip in value:
-                    if self.lives == 3:
-                        self.lives -= 1
-                        self.lives_group.remove(self.life3)
-                        self.all_sprites.remove(self.life3)
-                    elif self.lives == 2:
-                        self.lives -= 1
-                        self.lives_group.remove(self.life2)
-                        self.all_sprites.remove(self.life2)
-                    elif self.lives == 1:
-                        self.lives -= 1
-                        self.lives_group.remove(self.life1)
-                        self.all_sprites.remove(self.life1)
-                    elif self.lives == 0:
-                        self.game_over = True
-                        self.start_game = False
-                    self.sounds['shipexplosion'].play()
-                    explosion = Explosion(playerShip.rect.x, playerShip.rect.y,
-                                          0, True, False, 0)
-                    self.explosions_group.add(explosion)
-                    self.all_sprites.remove(playerShip)
-                    self.player_group.remove(playerShip)
-                    self.make_new_ship = True
-                    self.ship_timer = time.get_ticks()
-                    self.ship_alive = False
-
-        if sprite.groupcollide(self.aliens, self.player_group, True, True):
-            self.game_over = True
-            self.start_game = False
-
-        sprite.groupcollide(self.bullets, self.allBlockers, True, True)
-        sprite.groupcollide(self.alien_bullets, self.allBlockers, True, True)
-        sprite.groupcollide(self.aliens, self.allBlockers, False, True)
+    def draw_game(self):
+        return self.draw_render_list(self.render_list())
 
-    def create_new_ship(self, createShip, currentTime):
-        if createShip and (currentTime - self.ship_timer > 900):
-            self.player = Ship()
-            self.all_sprites.add(self.player)
-            self.player_group.add(self.player)
-            self.make_new_ship = False
-            self.ship_alive = True
+    def draw_game_over_text(self, surface, visible):
+        if visible:
+            self.game_over_text.draw(surface)
 
     def create_game_over(self, currentTime):
-        self.screen.blit(self.background, (0, 0))
         passed = currentTime - self.timer
-        if passed < 750:
-            self.game_over_text.draw(self.screen)
-        elif 750 < passed < 1500:
-            self.screen.blit(self.background, (0, 0))
-        elif 1500 < passed < 2250:
-            self.game_over_text.draw(self.screen)
-        elif 2250 < passed < 2750:
-            self.screen.blit(self.background, (0, 0))
-        elif passed > 3000:
-            self.main_screen = True
-
-        for e in event.get():
+        # the message blinks, shown for the first and third 750ms
+        self.game_over_layer.update(passed < 750 or 1500 < passed < 2250)
+        self.screen.blit(self.game_over_layer.surface, (0, 0))
+        if passed > 3000:
+            self.change_scene('title')
+
+        for _, e in self.get_events():
             if self.should_exit(e):
                 sys.exit()
 
     def main(self):
+        if self.ready:
+            self.start()
+        else:
+            self.change_scene('loading')
         while True:
-            if self.main_screen:
-                self.reset(0, 3, True)
-                self.screen.blit(self.background, (0, 0))
-                self.title_text.draw(self.screen)
-                self.title_text2.draw(self.screen)
-                self.alien1_text.draw(self.screen)
-                self.alien2_text.draw(self.screen)
-                self.alien3_text.draw(self.screen)
-                self.alien4_text.draw(self.screen)
-                self.create_main_menu()
-
-            elif self.start_game:
-                if len(self.aliens) == 0:
-                    current_time = time.get_ticks()
-                    if current_time - self.game_timer < 3000:
-                        self.screen.blit(self.background, (0, 0))
-                        self.scoreText2 = Text(FONT, 20, str(self.score),
-                                               GREEN, 85, 5)
-                        self.score_text.draw(self.screen)
-                        self.scoreText2.draw(self.screen)
-                        self.next_round_text.draw(self.screen)
-                        self.lives_text.draw(self.screen)
-                        self.lives_group.update(self.keys)
-                        self.check_input()
-                    if current_time - self.game_timer > 3000:
-                        # Move enemies closer to bottom
-                        self.alien_position_start += 35
-                        self.reset(self.score, self.lives)
-                        self.game_timer += 3000
-                else:
-                    current_time = time.get_ticks()
-                    self.play_main_music(current_time)
-                    self.screen.blit(self.background, (0, 0))
-                    self.allBlockers.update(self.screen)
-                    self.scoreText2 = Text(FONT, 20, str(self.score), GREEN,
-                                           85, 5)
-                    self.score_text.draw(self.screen)
-                    self.scoreText2.draw(self.screen)
-                    self.lives_text.draw(self.screen)
-                    self.check_input()
-                    self.all_sprites.update(self.keys, current_time,
-                                            self.aliens)
-                    self.explosions_group.update(self.keys, current_time)
-                    self.check_collisions()
-                    self.create_new_ship(self.make_new_ship, current_time)
-                    self.update_alien_speed()
-
-                    if len(self.aliens) > 0:
-                        self.make_aliens_shoot()
-
-            elif self.game_over:
-                current_time = time.get_ticks()
-                # Reset alien starting position
-                self.alien_position_start = self.alien_position_default
-                self.create_game_over(current_time)
-
+            if self.allocations:
+                self.allocations.start_frame()
+            scene = self.scene.name
+            self.frame()
+            if self.allocations:
+                self.allocations.end_frame(scene)
+            if self.latency or self.low_latency:
+                self.wait_for_frame()
+            else:
+                self.clock.tick(self.frame_rate)
+
+    def wait_for_frame(self):
+        """Wait out the frame cap as clock.tick() would, but take each
+        event off the queue as it arrives, so that it is stamped with the
+        time it came in. In low latency mode a key press also ends the wait
+        as soon as the next tick is due, so the tick that reads the press
+        and the frame that shows it come up to a frame sooner."""
+        now = perf_counter()
+        deadline = now
+        if self.frame_rate and self.wait_end is not None:
+            deadline = self.wait_end + 1.0 / self.frame_rate
+        tick_rate = self.sim.tick_rate if self.ready else TICK_RATE
+        while True:
+            if (self.low_latency and self.last_frame is not None and
+                    any(e.type == KEYDOWN for _, e in self.arrived)):
+                deadline = min(deadline, self.last_frame +
+                               (1.0 - self.alpha) / tick_rate)
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            # wait() takes whole ms, and 0 would mean forever
+            e = event.wait(max(1, int(remaining * 1000)))
+            if e.type != NOEVENT:
+                self.arrived.append((perf_counter(), e))
+        self.wait_end = perf_counter()
+
+    def get_events(self):
+        """(arrival time, event) for every event since the last call: those
+        taken while waiting for the frame, then the rest of the queue."""
+        now = perf_counter()
+        events = self.arrived + [(now, e) for e in event.get()]
+        self.arrived = []
+        if any(e.type in EXPOSE_EVENTS for _, e in events):
+            self.expose()
+        return events
+
+    def expose(self):
+        """Draw and present the whole window again, after it has been
+        uncovered or restored."""
+        self.exposed = True
+        if self.renderer:
+            self.renderer.invalidate()
+
+    def due_ticks(self):
+        """The number of whole ticks of wall time since the last frame.
+
+        The remainder carries over to the next frame and sets alpha, so
+        the game runs at the same speed whatever the frame rate.
+        """
+        now = perf_counter()
+        if self.last_frame is not None:
+            self.lag += now - self.last_frame
+        self.last_frame = now
+        tick_rate = self.sim.tick_rate if self.ready else TICK_RATE
+        ticks = int(self.lag * tick_rate)
+        if ticks > MAX_TICKS_PER_FRAME:
+            ticks = MAX_TICKS_PER_FRAME
+            self.lag = float(ticks) / tick_rate
+        self.lag -= float(ticks) / tick_rate
+        self.alpha = self.lag * tick_rate
+        return ticks
+
+    def frame(self, ticks=None):
+        """Run the simulation ticks that are due, or exactly ticks of them,
+        then update the current scene and present whatever it changed."""
+        profiler = self.profiler if self.mark is not no_mark else None
+        if profiler:
+            profiler.start_frame(self.scene.name)
+        if ticks is None:
+            ticks = self.due_ticks()
+        else:
+            self.alpha = 1.0
+        for _ in range(ticks):
+            self.scene.tick()
+        if self.render_thread:
+            self.pipeline(profiler)
+        else:
+            changed = self.scene.update()
+            if self.latency:
+                self.latency.draw()
+            if profiler and self.mark is not no_mark:
+                profiler.mark('overlay')
+                changed = self.draw_overlay(profiler, changed)
+                profiler.mark('present')
+            self.present(changed)
+        if profiler:
+            profiler.end_frame()
+
+    def pipeline(self, profiler):
+        """The threaded end of a frame: present the frame drawn while this
+        one's ticks ran, then hand this one to the render thread."""
+        self.mark('wait')
+        changed = self.render_thread.wait()
+        self.mark('present')
+        self.present(changed)
+        self.mark('draw')
+        render_list = self.scene.render_list()
+        if self.latency:
+            self.latency.draw()
+        if render_list is None:
+            # a scene drawn on this thread, shown straight away
+            changed = self.scene.update()
+            if profiler and self.mark is not no_mark:
+                changed = self.draw_overlay(profiler, changed)
+            self.present(changed)
+            return
+        overlay = profiler if self.mark is not no_mark else None
+
+        def job():
+            changed = self.draw_render_list(render_list)
+            if overlay:
+                changed = self.draw_overlay(overlay, changed)
+            return changed
+        self.render_thread.submit(job)
+
+    def draw_overlay(self, profiler, changed):
+        rect = profiler.draw(self.screen)
+        if changed is not True:
+            changed = (changed or []) + [rect]
+        return changed
+
+    def present(self, changed):
+        if self.exposed:
+            self.exposed = False
+            changed = True
+        if changed and self.viewport:
+            changed = self.viewport.scale(changed)
+        if changed is True:
             display.update()
-            self.clock.tick(60)
+        elif changed:
+            display.update(changed)
+        if changed and self.latency:
+            self.latency.present()
+
+
+def parse_size(text):
+    """(width, height) from WIDTHxHEIGHT, for the command line."""
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected WIDTHxHEIGHT, e.g. 1920x1080, not {!r}'.format(text))
+    return width, height
 
 
 if __name__ == '__main__':
-    game = SpaceInvaders()
-    game.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count-allocations', action='store_true',
+                        help='report memory allocated per frame in each '
+                             'scene on exit')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='only redraw and present the parts of the '
+                             'screen that changed')
+    parser.add_argument('--bullet-limit', type=int, default=4,
+                        help='player shots allowed on screen at once')
+    parser.add_argument('--fire-interval', type=int, default=0,
+                        help='minimum ms between player shots')
+    parser.add_argument('--alien-fire-interval', type=int, default=700,
+                        help='ms between alien shots')
+    parser.add_argument('--dual-lasers', type=int, metavar='SCORE',
+                        help='fire two lasers at once from this score on')
+    parser.add_argument('--pixel-collisions', action='store_true',
+                        help='only count hits where opaque pixels touch')
+    parser.add_argument('--tick-rate', type=int, default=TICK_RATE,
+                        help='simulation ticks per second '
+                             '(default %(default)s)')
+    parser.add_argument('--fps', type=int,
+                        help='most frames drawn per second, 0 for no cap '
+                             '(default {}, or no cap with --vsync)'.format(
+                                 FRAME_RATE))
+    parser.add_argument('--vsync', action='store_true',
+                        help='draw in step with the display where supported')
+    parser.add_argument('--window', type=parse_size, default=SCREEN_SIZE,
+                        metavar='WIDTHxHEIGHT',
+                        help='window size; the {}x{} game is scaled to fit '
+                             'it'.format(*SCREEN_SIZE))
+    parser.add_argument('--fullscreen', action='store_true',
+                        help='fill the screen at the desktop resolution')
+    parser.add_argument('--scale', choices=['smooth', 'integer'],
+                        default='smooth',
+                        help='scale frames to the window smoothly, filling '
+                             'it, or by whole multiples for sharp pixels '
+                             '(default %(default)s)')
+    parser.add_argument('--threaded', action='store_true',
+                        help='draw each frame on a second thread while the '
+                             'next one is simulated')
+    parser.add_argument('--debris', action='store_true',
+                        help='throw sparks out of every explosion')
+    parser.add_argument('--input-latency', action='store_true',
+                        help='time each fire press to the tick that fires '
+                             'and the display update that shows the shot, '
+                             'and report histograms on exit')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='start the next frame as soon as a key press '
+                             'can be simulated instead of at the frame cap')
+    parser.add_argument('--profile', action='store_true',
+                        help='time each phase of a frame and show it as an '
+                             'overlay (F3 toggles it while playing)')
+    parser.add_argument('--profile-trace', metavar='PATH',
+                        help='profile, and save the frames as a Chrome '
+                             'trace to PATH on exit')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record each game to PATH for replaying')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='play back a recorded game and check it ends '
+                             'in the recorded state')
+    parser.add_argument('--bake-assets', action='store_true',
+                        help='decode every image and sound into assets.bin '
+                             'for a faster start, then exit')
+    args = parser.parse_args()
+    if args.bake_assets:
+        AssetBundle.bake(BUNDLE_PATH)
+        sys.exit()
+    rules = {'bullet_limit': args.bullet_limit,
+             'fire_interval': args.fire_interval,
+             'alien_fire_interval': args.alien_fire_interval,
+             'dual_laser_score': args.dual_lasers,
+             'tick_rate': args.tick_rate,
+             'pixel_collisions': args.pixel_collisions}
+    replay = Recording.load(args.replay) if args.replay else None
+    if args.fps is not None:
+        frame_rate = args.fps
+    else:
+        frame_rate = 0 if args.vsync else FRAME_RATE
+    game = SpaceInvaders(count_allocations=args.count_allocations,
+                         dirty_rects=args.dirty_rects, rules=rules,
+                         record=args.record, replay=replay,
+                         profile=args.profile,
+                         profile_trace=args.profile_trace,
+                         load_in_background=True,
+                         frame_rate=frame_rate, vsync=args.vsync,
+                         threaded=args.threaded, debris=args.debris,
+                         window_size=args.window, fullscreen=args.fullscreen,
+                         smooth_scaling=args.scale == 'smooth',
+                         input_latency=args.input_latency,
+                         low_latency=args.low_latency)
+    try:
+        game.main()
+    finally:
+        game.report()
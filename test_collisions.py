@@ -0,0 +1,30 @@
+"""Shots remove what they hit the way the game always has.
+
+    python -m pytest
+"""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from spaceinvaders import INPUT_FIRE, Mystery, Simulation  # noqa: E402
+
+
+def test_dual_laser_volley_kills_the_mystery_once():
+    # one alien, out of the way of the shots
+    sim = Simulation(seed=1, dual_laser_score=0, alien_columns=1,
+                     alien_rows=1)
+    sim.step()
+    sim.mystery_ship.rect.centerx = sim.player.rect.centerx
+    sim.step(INPUT_FIRE)
+    assert len(sim.bullets) == 2
+
+    kills = 0
+    score = sim.score
+    while sim.bullets:
+        sim.step()
+        kills += sim.events.count('mysterykilled')
+    assert kills == 1
+    assert sim.score - score in (50, 100, 150, 300)
+    assert len(sim.mystery_group) == 1
+    assert sum(isinstance(item, Mystery) for item in sim.all_sprites) == 1
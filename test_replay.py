@@ -0,0 +1,66 @@
+"""Recordings replay bit for bit and verify by their state hash.
+
+    python -m pytest
+"""
+import os
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from headless import autopilot  # noqa: E402
+from replay import play  # noqa: E402
+from spaceinvaders import (INPUT_LEFT, Recorder, Recording,  # noqa: E402
+                           Simulation)
+
+
+def record(sim, player, ticks, path):
+    """Record up to ticks of a game on sim, save it and load it back."""
+    recorder = Recorder(sim)
+    for _ in range(ticks):
+        if sim.game_over:
+            break
+        recorder.step(player(sim))
+    recorder.save(path)
+    return Recording.load(path)
+
+
+def idle(sim):
+    return 0
+
+
+def test_every_game_on_a_simulation_replays(tmp_path):
+    sim = Simulation(seed=7)
+    path = str(tmp_path / 'game.rep')
+    # a played game, then games on the same simulation, one without kills
+    for seed, player, ticks in ((7, autopilot, 3000), (8, autopilot, 2000),
+                                (9, idle, 600)):
+        sim.reset(0, 3, True, seed)
+        recording = record(sim, player, ticks, path)
+        assert play(recording).state_hash() == recording.final_hash
+
+
+def test_recording_keeps_the_simulation_rules(tmp_path):
+    sim = Simulation(seed=42, bullet_limit=6, fire_interval=100,
+                     dual_laser_score=200, tick_rate=60)
+    recording = record(sim, autopilot, 2000, str(tmp_path / 'game.rep'))
+    assert recording.simulation().rules == sim.rules
+    assert play(recording).state_hash() == recording.final_hash
+
+
+def test_changed_controls_change_the_hash(tmp_path):
+    recording = record(Simulation(seed=3), autopilot, 1500,
+                       str(tmp_path / 'game.rep'))
+    # one tick of the ship moving differently
+    recording.controls[100] ^= INPUT_LEFT
+    assert play(recording).state_hash() != recording.final_hash
+
+
+def test_recording_refuses_a_seed_it_cannot_save():
+    sim = Simulation(seed=1)
+    sim.seed = 2 ** 64
+    with pytest.raises(ValueError):
+        Recorder(sim)
+    with pytest.raises(ValueError):
+        Recording(-1)
@@ -0,0 +1,103 @@
+"""Simulation.snapshot(), restore() and fork() carry a game on exactly.
+
+    python -m pytest
+"""
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from headless import autopilot  # noqa: E402
+from spaceinvaders import INPUT_FIRE, Simulation  # noqa: E402
+
+
+def mid_game(**rules):
+    """A simulation with shots, explosions and bunker damage in play."""
+    sim = Simulation(seed=11, **rules)
+    for _ in range(1500):
+        sim.step(autopilot(sim))
+    return sim
+
+
+def step(sim, ticks):
+    """Play on with the autopilot; returns the controls it gave."""
+    controls = []
+    for _ in range(ticks):
+        controls.append(autopilot(sim))
+        sim.step(controls[-1])
+    return controls
+
+
+def test_restore_carries_on_like_the_original():
+    sim = mid_game()
+    data = sim.snapshot()
+    controls = step(sim, 600)
+
+    other = Simulation(seed=99)
+    other.restore(data)
+    for control in controls:
+        other.step(control)
+    assert other.state_hash() == sim.state_hash()
+
+    # and going back in the simulation that moved on
+    sim.restore(data)
+    for control in controls:
+        sim.step(control)
+    assert sim.state_hash() == other.state_hash()
+
+
+def test_fork_is_independent():
+    sim = mid_game()
+    before = sim.state_hash()
+    fork = sim.fork()
+    assert fork.state_hash() == before
+    controls = step(fork, 600)
+    assert sim.state_hash() == before
+    for control in controls:
+        sim.step(control)
+    assert sim.state_hash() == fork.state_hash()
+
+
+def test_restore_refuses_a_simulation_that_cannot_hold_it():
+    sim = Simulation(seed=1)
+    for tick in range(40):
+        sim.step(INPUT_FIRE if tick % 10 == 0 else 0)
+    assert len(sim.bullets) > 1
+    data = sim.snapshot()
+
+    for rules in ({'bullet_limit': 1}, {'alien_columns': 11},
+                  {'alien_scale': 0.5}, {'tick_rate': 60}):
+        other = Simulation(seed=2, **rules)
+        before = other.state_hash()
+        with pytest.raises(ValueError):
+            other.restore(data)
+        assert other.state_hash() == before
+
+    other = Simulation(seed=2)
+    for bad in (data[:-1], data + b'\0', data[:20], b'XXXX' + data[4:]):
+        with pytest.raises(ValueError):
+            other.restore(bad)
+
+
+def test_snapshot_holds_any_seed_and_lives_it_accepts():
+    # lives as high as the benchmarks' invincible games give the ship
+    sim = Simulation(seed=2 ** 64 - 1)
+    sim.reset(0, sys.maxsize)
+    other = Simulation(seed=0)
+    other.restore(sim.snapshot())
+    assert (other.seed, other.lives) == (2 ** 64 - 1, sys.maxsize)
+    assert other.state_hash() == sim.state_hash()
+
+
+def test_seeds_a_snapshot_cannot_hold_are_refused():
+    sim = Simulation(seed=5)
+    before = sim.state_hash()
+    for seed in (-1, 2 ** 64):
+        with pytest.raises(ValueError):
+            Simulation(seed=seed)
+        with pytest.raises(ValueError):
+            sim.reset(0, 3, True, seed)
+        assert sim.state_hash() == before